@@ -1,15 +1,31 @@
+import csv
+import io
+import json
 import os
+import queue
+import time
+from datetime import date, timedelta
 
-from flask import Flask, flash, redirect, render_template, request, session
+from flask import Flask, Response, flash, jsonify, redirect, render_template, request, session, stream_with_context
 from flask_session import Session
-from werkzeug.security import check_password_hash, generate_password_hash
 
 from flask_sqlalchemy import SQLAlchemy
 
 from sqlalchemy import text
 
-from helpers import apology, login_required, lookup, usd, percent, search, check_env_vars, format_date
-from datetime import datetime
+from auth import AuthBusy, check_password, hash_password, verify_captcha
+from database import configure_engine, engine_options
+from ledger import LedgerEngine
+from metrics import instrument, metrics
+from migrations import migrate
+from orders import LegError, OrderError, execute_basket, execute_buy, execute_deposit, execute_sell
+from pricehistory import portfolio_analytics
+from sessions import SQLiteSessionInterface
+from streaming import PriceFeed
+from helpers import api_error, api_login_required, cached_json, weak_etag
+from helpers import apology, login_required, lookup, lookup_many, usd, percent, search, check_env_vars, format_date, quote_cache_samples, current_prices, price_history, PRICE_CACHE_TTL
+from finnhub import finnhub_samples, is_degraded
+from symbols import symbol_index
 import requests
 
 # Configure application
@@ -23,37 +39,54 @@ app.jinja_env.filters["usd"] = usd
 app.jinja_env.filters["percent"] = percent
 app.jinja_env.filters["format_date"] = format_date
 
-# Configure session to use filesystem (instead of signed cookies)
+# JSON of API responses without whitespace, keys in insertion order
+app.json.compact = True
+app.json.sort_keys = False
+
+# Configure session store: "sqlite" table in the database, signed "cookie" or "filesystem"
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite")
+SESSION_LIFETIME = int(os.environ.get("SESSION_LIFETIME", 7 * 24 * 60 * 60))
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
 
 # Configure the SQLAlchemy database URI to use a SQLite database located in the main folder and named 'finance.db'
 basedir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(
-    basedir, 'finance.db')
+DATABASE_PATH = os.environ.get("DATABASE_PATH",
+                               os.path.join(basedir, 'finance.db'))
+app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + DATABASE_PATH
+
+# Set the SQLALCHEMY_ECHO environment variable to 1 to enable logging of SQL statements
+app.config['SQLALCHEMY_ECHO'] = os.environ.get("SQLALCHEMY_ECHO") == "1"
 
-# Set the SQLALCHEMY_ECHO configuration key to True to enable logging of SQL statements
-app.config['SQLALCHEMY_ECHO'] = True
+# Configure connection pool of the engine
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
 
 # Create a SQLAlchemy instance
 db = SQLAlchemy(app)
 
-# Create database if not exists
-sql_init_commands = [
-    "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, username TEXT NOT NULL, hash TEXT NOT NULL, cash NUMERIC NOT NULL DEFAULT 10000.00);",
-    "CREATE UNIQUE INDEX IF NOT EXISTS username ON users (username);",
-    "CREATE TABLE IF NOT EXISTS transactions(user_id INTEGER, orderid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, name TEXT NOT NULL, symbol TEXT NOT NULL, type TEXT NOT NULL, price NUMERIC NOT NULL, shares INTEGER NOT NULL, date TEXT NOT NULL, FOREIGN KEY (user_id) REFERENCES users(id));",
-    "CREATE TABLE IF NOT EXISTS wallet(user_id INTEGER, name TEXT NOT NULL, symbol TEXT NOT NULL, shares INTEGER NOT NULL, FOREIGN KEY (user_id) REFERENCES users(id));"
-]
-
-if not os.path.exists(os.path.join(basedir, 'finance.db')):
-    with app.app_context():
-        with db.engine.connect() as connection:
-            for command in sql_init_commands:
-                connection.execute(text(command))
-else:
-    print("Database already exists.")
+with app.app_context():
+    # Set WAL mode and other pragmas on every new connection
+    configure_engine(db.engine)
+
+    # Create database if not exists and upgrade its schema to the latest version
+    migrate(db.engine)
+
+    # Time requests, SQL, outbound HTTP and templates, exposed on /metrics
+    instrument(app, db.engine)
+
+    # Keep sessions in a database table instead of a file per session
+    if SESSION_BACKEND == "sqlite":
+        app.session_interface = SQLiteSessionInterface(db.engine,
+                                                       SESSION_LIFETIME)
+
+# Signed cookies keep sessions in browser, workers don't store anything
+if SESSION_BACKEND == "cookie":
+    check_env_vars(["SECRET_KEY"])
+    app.secret_key = os.environ.get("SECRET_KEY")
+elif SESSION_BACKEND == "filesystem":
+    app.config["SESSION_TYPE"] = "filesystem"
+    Session(app)
+elif SESSION_BACKEND != "sqlite":
+    raise RuntimeError(f"Unknown session backend: {SESSION_BACKEND}")
 
 # Make sure environmental variables are set
 required_env_vars = ["API_KEY", "HCAPTCHA_SITE_KEY", "HCAPTCHA_SECRET_KEY"]
@@ -61,41 +94,81 @@ check_env_vars(required_env_vars)
 
 # Retrieve environment variables
 HCAPTCHA_SITE_KEY = os.environ.get("HCAPTCHA_SITE_KEY")
-HCAPTCHA_SECRET_KEY = os.environ.get("HCAPTCHA_SECRET_KEY")
+
+# Number of transactions shown on one history page and columns of CSV export
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", 50))
+HISTORY_CSV_COLUMNS = ["orderid", "date", "symbol", "name", "type", "shares", "price"]
+
+# Default and longest period of portfolio analytics (days)
+ANALYTICS_DAYS = int(os.environ.get("ANALYTICS_DAYS", 90))
+ANALYTICS_MAX_DAYS = int(os.environ.get("ANALYTICS_MAX_DAYS", 5 * 365))
+
+# Replayed ledgers kept per worker; new orders extend them, so entries may live long
+LEDGER_CACHE_SIZE = int(os.environ.get("LEDGER_CACHE_SIZE", 1024))
+LEDGER_CACHE_TTL = float(os.environ.get("LEDGER_CACHE_TTL", 60 * 60))
+
+ledger_engine = LedgerEngine(price_history, LEDGER_CACHE_SIZE, LEDGER_CACHE_TTL)
+
+# Largest number of orders accepted in one basket
+BASKET_MAX_ORDERS = int(os.environ.get("BASKET_MAX_ORDERS", 50))
+
+# How often streamed prices are checked and how often idle streams send a keep-alive (seconds)
+STREAM_INTERVAL = float(os.environ.get("STREAM_INTERVAL", 5))
+STREAM_HEARTBEAT = float(os.environ.get("STREAM_HEARTBEAT", 15))
+
+# Every open stream holds a sync worker, so portfolio pages only stream with gthread or gevent workers
+PRICE_STREAM = os.environ.get(
+    "PRICE_STREAM", "off" if os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+    == "sync" else "on") == "on"
+
+# Streams end before gunicorn timeout and browsers reconnect; raise it with gevent workers
+STREAM_MAX_DURATION = float(os.environ.get("STREAM_MAX_DURATION", 25))
+
+# One price feed per worker shared by all of its streaming clients
+price_feed = PriceFeed(current_prices, STREAM_INTERVAL)
+
+
+@app.errorhandler(AuthBusy)
+def auth_busy(error):
+    """Reject login when password hashing is overloaded"""
+    return apology("Too many login attempts, try again later.", 503)
+
+
+# Counters kept by caches and Finnhub client are published with the rest of metrics
+metrics.register_collector(quote_cache_samples)
+metrics.register_collector(finnhub_samples)
 
 
 @app.after_request
 def after_request(response):
-    """Ensure responses aren't cached"""
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
+    """Ensure responses aren't cached, unless route set its own caching policy"""
+    if "Cache-Control" not in response.headers:
+        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+        response.headers["Expires"] = 0
+        response.headers["Pragma"] = "no-cache"
     return response
 
 
-@app.route("/")
-@login_required
-def index():
-    """Show portfolio of stocks"""
+def portfolio(user_id):
+    """Value holdings of user at current prices"""
 
     wallet = db.session.execute(
-        text("SELECT name, symbol, shares FROM wallet WHERE user_id = :user_id"
-             ), {"user_id": session["user_id"]})
-    cash = db.session.execute(text("SELECT cash FROM users WHERE id = :id"),
-                              {"id": session["user_id"]})
-    buy_transactions = db.session.execute(
         text(
-            "SELECT symbol, SUM(price * shares) AS purchased, SUM(shares) AS buyed_shares FROM transactions WHERE user_id = :user_id AND type = 'buy' GROUP BY symbol"
-        ), {"user_id": session["user_id"]})
+            "SELECT name, symbol, shares, bought_cost, bought_shares FROM wallet WHERE user_id = :user_id"
+        ), {"user_id": user_id})
+    cash = db.session.execute(text("SELECT cash FROM users WHERE id = :id"),
+                              {"id": user_id})
 
     # Get all row data from query and represent as dictionary
     wallet = wallet.mappings().all()
     cash = cash.mappings().all()
-    buy_transactions = buy_transactions.mappings().all()
 
     total_stock_value = 0
     index = []
 
+    # Check current prices of all stocks at once using concurrent api requests
+    quotes = lookup_many([row["symbol"] for row in wallet])
+
     # Iterate through each row of wallet
     for row in wallet:
 
@@ -104,30 +177,30 @@ def index():
         symbol = row["symbol"]
         shares = row["shares"]
 
-        # Get total cost of purchases and number of buyed shares for given symbol
-        purchased = next(item for item in buy_transactions
-                         if item["symbol"] == symbol)["purchased"]
-        buyed_shares = next(item for item in buy_transactions
-                            if item["symbol"] == symbol)["buyed_shares"]
+        # Total cost of purchases and number of buyed shares are kept in wallet
+        purchased = row["bought_cost"]
+        buyed_shares = row["bought_shares"]
 
-        average_cost_per_share = purchased / buyed_shares
+        average_cost_per_share = purchased / buyed_shares if buyed_shares else 0
 
         total_investment = average_cost_per_share * shares
 
-        # Check current price using api request
-        quote = lookup(symbol)
+        # Current price fetched by batch lookup
+        quote = quotes[symbol]
 
         if quote is None:
         # If lookup fails, use this values in dictionary:
             entry = {
                 "name": name,
-                "symbol": f'{symbol} - currently unavailable ',
+                "symbol": symbol,
                 "shares": shares,
                 "price": 0,
                 "value": 0,
                 "invested": total_investment,
                 "net_profit": 0,
-                "percent_profit": 0
+                "percent_profit": 0,
+                "stale": False,
+                "available": False
             }
 
             index.append(entry)
@@ -140,7 +213,8 @@ def index():
 
         net_profit = value - total_investment
 
-        percent_profit = net_profit / total_investment * 100
+        # Shares without recorded buys (bought_shares backfilled as 0) have no percentage
+        percent_profit = net_profit / total_investment * 100 if total_investment else 0
 
         # Populate index dictionary with information to display
         entry = {
@@ -151,7 +225,9 @@ def index():
             "value": value,
             "invested": total_investment,
             "net_profit": net_profit,
-            "percent_profit": percent_profit
+            "percent_profit": percent_profit,
+            "stale": quote["stale"],
+            "available": True
         }
 
         index.append(entry)
@@ -162,11 +238,76 @@ def index():
     # Sum of stock value and cash
     total = total_stock_value + cash[0]["cash"]
 
+    # Some prices are last known values, because Finnhub is currently unavailable
+    degraded = is_degraded() or any(entry["stale"] for entry in index)
+
+    return {
+        "index": index,
+        "total_stock_value": total_stock_value,
+        "cash": cash[0]["cash"],
+        "total": total,
+        "degraded": degraded
+    }
+
+
+@app.route("/")
+@login_required
+def index():
+    """Show portfolio of stocks"""
+
     return render_template("index.html",
-                           index=index,
-                           total_stock_value=total_stock_value,
-                           cash=cash[0]["cash"],
-                           total=total)
+                           streaming=PRICE_STREAM,
+                           **portfolio(session["user_id"]))
+
+
+@app.route("/stream/portfolio")
+@login_required
+def stream_portfolio():
+    """Stream changed prices of held stocks as Server-Sent Events"""
+
+    # No content tells browsers not to reconnect
+    if not PRICE_STREAM:
+        return "", 204
+
+    wallet = db.session.execute(
+        text("SELECT symbol FROM wallet WHERE user_id = :user_id"),
+        {"user_id": session["user_id"]}).mappings().all()
+
+    # Stream outlives the request, so database connection is returned to the pool now
+    db.session.close()
+
+    subscription = price_feed.subscribe([row["symbol"] for row in wallet])
+
+    def events():
+        try:
+            # Browser reconnects a moment after the stream ends
+            yield f"retry: {int(STREAM_INTERVAL * 1000)}\n\n"
+
+            deadline = time.monotonic() + STREAM_MAX_DURATION
+            while time.monotonic() < deadline:
+                try:
+                    prices = subscription.queue.get(
+                        timeout=max(0, min(STREAM_HEARTBEAT,
+                                           deadline - time.monotonic())))
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                yield f"event: prices\ndata: {json.dumps(prices)}\n\n"
+        finally:
+            price_feed.unsubscribe(subscription)
+
+    # Tell nginx to pass events through instead of buffering them
+    return Response(events(),
+                    mimetype="text/event-stream",
+                    headers={"X-Accel-Buffering": "no"})
+
+
+@app.route("/performance")
+@login_required
+def performance():
+    """Show chart of account value over time"""
+    return render_template("performance.html", days=ANALYTICS_DAYS)
 
 
 @app.route("/buy", methods=["GET", "POST"])
@@ -183,12 +324,20 @@ def buy():
         if not symbol:
             return apology("You must provide a symbol.", 400)
 
+        # Look up the stock using the symbol provided by the user
+        stock = lookup(symbol)
+
         # Check if proper symbol was submitted
-        if not lookup(symbol):
+        if not stock:
             return apology(
                 "Invalid stock symbol. Use the search function to look for suitable symbols.",
                 400)
 
+        # Don't trade at last known price
+        if stock["stale"]:
+            return apology("Prices are currently unavailable, try again later.",
+                           503)
+
         # Ensure share was submitted
         if not shares:
             return apology("You must provide shares.", 400)
@@ -206,85 +355,47 @@ def buy():
 
         # all checks for input passed
 
-        # Look up the stock using the symbol provided by the user
-        stock = lookup(request.form.get("symbol"))
+        # Check cash, add transaction, update cash and wallet in a single database transaction
+        try:
+            execute_buy(db.session, session["user_id"], stock, int(shares))
+        except OrderError as error:
+            return apology(error.message, error.code)
 
-        # Retrieve the current user's cash balance from the database, convert the result to a list of dictionaries
-        cash = db.session.execute(
-            text("SELECT cash FROM users WHERE id = :id"),
-            {"id": session["user_id"]})
-        cash = cash.mappings().all()
+        return redirect("/")
 
-        # Calculate the total price of the transaction
-        total_price = stock["price"] * int(shares)
+    # User reached route via GET (as by clicking a link or via redirect)
+    else:
+        return render_template("buy.html")
 
-        # Check if user have enough cash
-        if cash[0]["cash"] < total_price:
-            return apology("You need to provide more cash.", 403)
 
-        # Updating database
-        # Add transaction
-        db.session.execute(
-            text(
-                "INSERT INTO transactions (user_id, name, symbol, type, price, shares, date) VALUES (:user_id, :name, :symbol, :type, :price, :shares, :date)"
-            ), {
-                "user_id": session["user_id"],
-                "name": stock["name"],
-                "symbol": stock["symbol"],
-                "type": 'buy',
-                "price": stock["price"],
-                "shares": int(shares),
-                "date": datetime.now()
-            })
+def history_filters():
+    """Build WHERE clause and parameters for transactions from query string filters"""
 
-        # Update cash
-        db.session.execute(
-            text("UPDATE users SET cash = :cash  WHERE id = :user_id"), {
-                "cash": cash[0]["cash"] - total_price,
-                "user_id": session["user_id"]
-            })
+    conditions = ["user_id = :user_id"]
+    parameters = {"user_id": session["user_id"]}
 
-        # Commit the transaction
-        db.session.commit()
-
-        # Check if in wallet bought stock exists; if no: insert new entry to wallet; if yes: update wallet
-        wallet = db.session.execute(
-            text(
-                "SELECT * FROM wallet WHERE user_id = :user_id AND symbol = :symbol"
-            ), {
-                "user_id": session["user_id"],
-                "symbol": stock["symbol"]
-            })
-        wallet = wallet.mappings().all()
+    symbol = request.args.get("symbol", "").upper()
+    if symbol:
+        conditions.append("symbol = :symbol")
+        parameters["symbol"] = symbol
 
-        if len(wallet) == 0:
-            db.session.execute(
-                text(
-                    "INSERT INTO wallet (user_id, name, symbol, shares) VALUES (:user_id, :name, :symbol, :shares)"
-                ), {
-                    "user_id": session["user_id"],
-                    "name": stock["name"],
-                    "symbol": stock["symbol"],
-                    "shares": int(shares)
-                })
-        else:
-            db.session.execute(
-                text(
-                    "UPDATE wallet SET shares = :shares WHERE user_id = :user_id AND symbol = :symbol"
-                ), {
-                    "shares": wallet[0]["shares"] + int(shares),
-                    "user_id": session["user_id"],
-                    "symbol": stock["symbol"]
-                })
+    transaction_type = request.args.get("type", "")
+    if transaction_type in ["buy", "sell"]:
+        conditions.append("type = :type")
+        parameters["type"] = transaction_type
 
-        # Commit the transaction
-        db.session.commit()
+    # Dates are stored as ISO strings, so they can be compared as text; raises ValueError if invalid
+    if request.args.get("from"):
+        date_from = date.fromisoformat(request.args.get("from"))
+        conditions.append("date >= :date_from")
+        parameters["date_from"] = date_from.isoformat()
 
-        return redirect("/")
+    if request.args.get("to"):
+        date_to = date.fromisoformat(request.args.get("to")) + timedelta(days=1)
+        conditions.append("date < :date_to")
+        parameters["date_to"] = date_to.isoformat()
 
-    # User reached route via GET (as by clicking a link or via redirect)
-    else:
-        return render_template("buy.html")
+    return " AND ".join(conditions), parameters
 
 
 @app.route("/history")
@@ -292,12 +403,79 @@ def buy():
 def history():
     """Show history of transactions"""
 
+    try:
+        where, parameters = history_filters()
+    except ValueError:
+        return apology("Dates must be in YYYY-MM-DD format.", 400)
+
+    # Keyset pagination: next page starts below the last shown orderid
+    before = request.args.get("before", type=int)
+    if before is not None:
+        where += " AND orderid < :before"
+        parameters["before"] = before
+
+    # Fetch one more row than shown to know whether there is a next page
+    parameters["limit"] = HISTORY_PAGE_SIZE + 1
+
     transactions = db.session.execute(
-        text("SELECT * FROM transactions WHERE user_id = :user_id"), {
-            "user_id": session["user_id"]
-        }).mappings().all()
+        text(
+            f"SELECT * FROM transactions WHERE {where} ORDER BY orderid DESC LIMIT :limit"
+        ), parameters).mappings().all()
+
+    next_before = None
+    if len(transactions) > HISTORY_PAGE_SIZE:
+        transactions = transactions[:HISTORY_PAGE_SIZE]
+        next_before = transactions[-1]["orderid"]
+
+    # Filters are kept in links to next page and to export
+    filters = {
+        key: value
+        for key, value in request.args.items() if key != "before"
+    }
+
+    return render_template("history.html",
+                           transactions=transactions,
+                           filters=filters,
+                           next_before=next_before)
+
+
+@app.route("/history.csv")
+@login_required
+def history_csv():
+    """Export filtered history of transactions as CSV"""
+
+    try:
+        where, parameters = history_filters()
+    except ValueError:
+        return apology("Dates must be in YYYY-MM-DD format.", 400)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
 
-    return render_template("history.html", transactions=transactions)
+        writer.writerow(HISTORY_CSV_COLUMNS)
+
+        # Rows are fetched from database in chunks while response is sent
+        result = db.session.execute(
+            text(
+                f"SELECT {', '.join(HISTORY_CSV_COLUMNS)} FROM transactions WHERE {where} ORDER BY orderid"
+            ), parameters).yield_per(500)
+
+        for row in result:
+            writer.writerow(row)
+
+            # Send buffered rows and reuse the buffer
+            if buffer.tell() > 8192:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={"Content-Disposition": "attachment; filename=history.csv"})
 
 
 @app.route("/login", methods=["GET", "POST"])
@@ -316,15 +494,12 @@ def login():
             return apology("You must complete the captcha", 400)
 
         # Verify the token with hCaptcha's API
-        response = requests.post('https://hcaptcha.com/siteverify',
-                                 data={
-                                     'secret': HCAPTCHA_SECRET_KEY,
-                                     'sitekey': HCAPTCHA_SITE_KEY,
-                                     'response': token
-                                 })
-        result = response.json()
-
-        if result["success"] == False:
+        try:
+            captcha_passed = verify_captcha(token)
+        except (requests.RequestException, KeyError, ValueError):
+            return apology("Captcha verification is currently unavailable", 503)
+
+        if not captcha_passed:
             return apology("Captcha verification failed", 400)
 
         # Ensure username was submitted
@@ -341,8 +516,11 @@ def login():
             {"username": request.form.get("username")})
         rows = rows.mappings().all()
 
+        # Return database connection to pool while password is checked
+        db.session.close()
+
         # Ensure username exists and password is correct
-        if len(rows) != 1 or not check_password_hash(
+        if len(rows) != 1 or not check_password(
                 rows[0]["hash"], request.form.get("password")):
             return apology("Invalid username and/or password.", 403)
 
@@ -379,14 +557,16 @@ def quote():
         if not request.form.get("symbol"):
             return apology("You must provide a symbol.", 400)
 
+        # lookup for symbol
+        stock = lookup(request.form.get("symbol"))
+
         # Check if proper symbol was submitted
-        if not lookup(request.form.get("symbol")):
+        if not stock:
             return apology(
                 "Invalid stock symbol. Use the search function to look for suitable symbols.",
                 400)
 
-        # lookup for symbol and send result to template
-        stock = lookup(request.form.get("symbol"))
+        # send result to template
         return render_template("quoted.html", stock=stock)
 
     # User reached route via GET (as by clicking a link or via redirect)
@@ -405,15 +585,12 @@ def register():
             return apology("You must complete the captcha", 400)
 
         # Verify the token with hCaptcha's API
-        response = requests.post('https://hcaptcha.com/siteverify',
-                                 data={
-                                     'secret': HCAPTCHA_SECRET_KEY,
-                                     'sitekey': HCAPTCHA_SITE_KEY,
-                                     'response': token
-                                 })
-        result = response.json()
-
-        if result["success"] == False:
+        try:
+            captcha_passed = verify_captcha(token)
+        except (requests.RequestException, KeyError, ValueError):
+            return apology("Captcha verification is currently unavailable", 503)
+
+        if not captcha_passed:
             return apology("Captcha verification failed", 400)
 
         # Ensure username was submitted
@@ -444,7 +621,7 @@ def register():
                  ),
             {
                 "username": request.form.get("username"),
-                "hash": generate_password_hash(request.form.get("password"))
+                "hash": hash_password(request.form.get("password"))
             })
 
         # Commit the transaction
@@ -514,76 +691,21 @@ def sell():
             return apology("You don't own that many stock.", 400)
 
         # Check current stock price
-        price = lookup(request.form.get("symbol"))["price"]
-
-        # Updating database
-        # Add transaction
-        db.session.execute(
-            text(
-                "INSERT INTO transactions (user_id, name, symbol, type, price, shares, date) VALUES (:user_id, :name, :symbol, :type, :price, :shares, :date)"
-            ), {
-                "user_id": session["user_id"],
-                "name": wallet[0]["name"],
-                "symbol": wallet[0]["symbol"],
-                "type": "sell",
-                "price": price,
-                "shares": int(shares),
-                "date": datetime.now()
-            })
-
-        # Commit the transaction
-        db.session.commit()
-
-        # Fetch the current cash value for the user
-        cash = db.session.execute(
-            text("SELECT cash FROM users WHERE id = :user_id"), {
-                "user_id": session["user_id"]
-            }).mappings().all()
-
-        # Calculate the total price
-        total_price = price * int(shares)
-
-        # Update the user's cash value
-        db.session.execute(
-            text("UPDATE users SET cash = :new_cash WHERE id = :user_id"), {
-                "new_cash": cash[0]["cash"] + total_price,
-                "user_id": session["user_id"]
-            })
-
-        # Update the shares in the wallet
-        db.session.execute(
-            text(
-                "UPDATE wallet SET shares = :shares WHERE user_id = :user_id AND symbol = :symbol"
-            ), {
-                "shares": wallet[0]["shares"] - int(shares),
-                "user_id": session["user_id"],
-                "symbol": symbol
-            })
-
-        # Commit the transaction
-        db.session.commit()
+        stock = lookup(request.form.get("symbol"))
 
-        # # Check if any of the stocks are left in the wallet
-        wallet = db.session.execute(
-            text(
-                "SELECT shares FROM wallet WHERE user_id = :user_id AND symbol = :symbol"
-            ), {
-                "user_id": session["user_id"],
-                "symbol": symbol
-            }).mappings().all()
+        # Don't trade at last known price
+        if stock is None or stock["stale"]:
+            return apology("Prices are currently unavailable, try again later.",
+                           503)
 
-        # If shares are zero, delete the stock from the wallet
-        if wallet[0]["shares"] == 0:
-            db.session.execute(
-                text(
-                    "DELETE FROM wallet WHERE user_id = :user_id AND symbol = :symbol"
-                ), {
-                    "user_id": session["user_id"],
-                    "symbol": symbol
-                })
+        price = stock["price"]
 
-        # Commit the transaction
-        db.session.commit()
+        # Update wallet, add transaction and update cash in a single database transaction
+        try:
+            execute_sell(db.session, session["user_id"], symbol, price,
+                         int(shares))
+        except OrderError as error:
+            return apology(error.message, error.code)
 
         return redirect("/")
 
@@ -633,21 +755,8 @@ def cash():
     if int(deposit) <= 0:
         return apology("Cash must be positive integer.", 400)
 
-    # Fetch the current cash value for the user
-    cash = db.session.execute(
-        text("SELECT cash FROM users WHERE id = :user_id"), {
-            "user_id": session["user_id"]
-        }).mappings().all()
-
-    # Update the user's cash value
-    db.session.execute(
-        text("UPDATE users SET cash = :new_cash WHERE id = :user_id"), {
-            "new_cash": cash[0]["cash"] + int(deposit),
-            "user_id": session["user_id"]
-        })
-
-    # Commit the transaction
-    db.session.commit()
+    # Add cash and record the deposit for account value history
+    execute_deposit(db.session, session["user_id"], int(deposit))
 
     # Redirect user to home page
     return redirect("/")
@@ -673,6 +782,23 @@ def test():
         return render_template("search.html")
 
 
+@app.route("/search/suggest")
+@login_required
+def suggest():
+    """Return as-you-type symbol suggestions as JSON"""
+
+    query = request.args.get("q", "")
+
+    # Search only symbols already loaded, so suggestions never wait for API or disk
+    return jsonify(symbol_index(wait=False).search(query, limit=10))
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Expose counters of all workers in Prometheus text format"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/password_change", methods=["POST"])
 @login_required
 def password_change():
@@ -696,14 +822,14 @@ def password_change():
     }).mappings().all()
 
     # Ensure password is correct
-    if not check_password_hash(user[0]["hash"], request.form.get("password")):
+    if not check_password(user[0]["hash"], request.form.get("password")):
         return apology("Invalid password.", 403)
 
     # Update pasword hash in database
     db.session.execute(
         text("UPDATE users SET hash = :hash WHERE id = :id"), {
             "id": session["user_id"],
-            "hash": generate_password_hash(request.form.get("newpassword"))
+            "hash": hash_password(request.form.get("newpassword"))
         })
 
     # Commit the transaction
@@ -711,3 +837,298 @@ def password_change():
 
     # Redirect user to home page
     return redirect("/")
+
+
+# JSON API for scripts and polling clients, authenticated by the same session cookie
+
+
+def order_request(data):
+    """Read symbol and positive number of shares of API order from JSON or form data"""
+
+    # JSON arrays and scalars carry no fields; form data is a dict too
+    if not isinstance(data, dict):
+        raise OrderError("Order must be an object.", 400)
+
+    symbol = str(data.get("symbol") or "").upper()
+
+    if not symbol:
+        raise OrderError("You must provide a symbol.", 400)
+
+    # Whole numbers or strings of digits only, int() would truncate 2.9 and accept true
+    shares = data.get("shares")
+    if isinstance(shares, str) and shares.strip().isdigit():
+        shares = int(shares)
+
+    if not isinstance(shares, int) or isinstance(shares, bool):
+        raise OrderError("The number of shares must be an integer.", 400)
+
+    if shares <= 0:
+        raise OrderError("The number of shares must be a positive integer.",
+                         400)
+
+    return symbol, shares
+
+
+@app.route("/api/v1/portfolio")
+@api_login_required
+def api_portfolio():
+    """Return holdings valued at current prices"""
+
+    holdings = portfolio(session["user_id"])
+
+    # ETag covers wallet, cash and prices, so it changes whenever any value does
+    return cached_json(
+        {
+            "holdings": holdings["index"],
+            "total_stock_value": holdings["total_stock_value"],
+            "cash": holdings["cash"],
+            "total": holdings["total"],
+            "degraded": holdings["degraded"]
+        }, "private, no-cache")
+
+
+@app.route("/api/v1/history")
+@api_login_required
+def api_history():
+    """Return page of transactions, newest first, with the same filters as /history"""
+
+    try:
+        where, parameters = history_filters()
+    except ValueError:
+        return api_error("Dates must be in YYYY-MM-DD format.", 400)
+
+    # Transactions are never changed, so the newest orderid identifies the whole history
+    last_orderid = db.session.execute(
+        text("SELECT MAX(orderid) FROM transactions WHERE user_id = :user_id"),
+        {"user_id": session["user_id"]}).scalar()
+    etag = weak_etag(last_orderid, sorted(request.args.items()))
+
+    if request.if_none_match.contains_weak(etag):
+        return cached_json(None, "private, no-cache", etag)
+
+    before = request.args.get("before", type=int)
+    if before is not None:
+        where += " AND orderid < :before"
+        parameters["before"] = before
+
+    parameters["limit"] = HISTORY_PAGE_SIZE + 1
+
+    transactions = db.session.execute(
+        text(
+            f"SELECT {', '.join(HISTORY_CSV_COLUMNS)} FROM transactions WHERE {where} ORDER BY orderid DESC LIMIT :limit"
+        ), parameters).mappings().all()
+
+    next_before = None
+    if len(transactions) > HISTORY_PAGE_SIZE:
+        transactions = transactions[:HISTORY_PAGE_SIZE]
+        next_before = transactions[-1]["orderid"]
+
+    return cached_json(
+        {
+            "transactions": [dict(row) for row in transactions],
+            "next_before": next_before
+        }, "private, no-cache", etag)
+
+
+@app.route("/api/v1/quote/<symbol>")
+@api_login_required
+def api_quote(symbol):
+    """Return current quote of symbol"""
+
+    stock = lookup(symbol)
+    if stock is None:
+        return api_error("Invalid stock symbol.", 404)
+
+    # Price may be reused by the client for as long as it stays in quote cache
+    return cached_json(stock, f"private, max-age={int(PRICE_CACHE_TTL)}")
+
+
+@app.route("/api/v1/analytics")
+@api_login_required
+def api_analytics():
+    """Return daily value, returns, volatility, drawdown and P&L of held positions from price history"""
+
+    days = request.args.get("days", ANALYTICS_DAYS, type=int)
+    if not 1 <= days <= ANALYTICS_MAX_DAYS:
+        return api_error(f"Days must be between 1 and {ANALYTICS_MAX_DAYS}.", 400)
+
+    wallet = db.session.execute(
+        text(
+            "SELECT symbol, shares, bought_cost, bought_shares FROM wallet WHERE user_id = :user_id ORDER BY symbol"
+        ), {"user_id": session["user_id"]}).mappings().all()
+
+    # Invested amount uses average cost per share, like the index page
+    positions = [{
+        "symbol": row["symbol"],
+        "shares": row["shares"],
+        "invested": row["bought_cost"] / row["bought_shares"] * row["shares"] if row["bought_shares"] else 0
+    } for row in wallet]
+
+    return cached_json(portfolio_analytics(price_history, positions, days),
+                       "private, no-cache")
+
+
+@app.route("/api/v1/value_history")
+@api_login_required
+def api_value_history():
+    """Return daily cash, stock value and account value replayed from the ledger"""
+
+    days = request.args.get("days", ANALYTICS_DAYS, type=int)
+    if not 1 <= days <= ANALYTICS_MAX_DAYS:
+        return api_error(f"Days must be between 1 and {ANALYTICS_MAX_DAYS}.", 400)
+
+    return cached_json(
+        ledger_engine.value_series(db.session, session["user_id"], days),
+        "private, no-cache")
+
+
+@app.route("/api/v1/buy", methods=["POST"])
+@api_login_required
+def api_buy():
+    """Buy shares of stock; body is JSON or form with symbol and shares"""
+
+    try:
+        symbol, shares = order_request(
+            request.get_json(silent=True) or request.form)
+
+        stock = lookup(symbol)
+        if stock is None:
+            raise OrderError("Invalid stock symbol.", 400)
+
+        # Don't trade at last known price
+        if stock["stale"]:
+            raise OrderError("Prices are currently unavailable, try again later.", 503)
+
+        execute_buy(db.session, session["user_id"], stock, shares)
+    except OrderError as error:
+        return api_error(error.message, error.code)
+
+    return jsonify({
+        "symbol": stock["symbol"],
+        "name": stock["name"],
+        "type": "buy",
+        "shares": shares,
+        "price": stock["price"]
+    })
+
+
+@app.route("/api/v1/sell", methods=["POST"])
+@api_login_required
+def api_sell():
+    """Sell shares of stock; body is JSON or form with symbol and shares"""
+
+    try:
+        symbol, shares = order_request(
+            request.get_json(silent=True) or request.form)
+
+        owned = db.session.execute(
+            text(
+                "SELECT shares FROM wallet WHERE user_id = :user_id AND symbol = :symbol"
+            ), {
+                "user_id": session["user_id"],
+                "symbol": symbol
+            }).scalar()
+        if owned is None:
+            raise OrderError("You don't own that stock.", 400)
+
+        stock = lookup(symbol)
+
+        # Don't trade at last known price
+        if stock is None or stock["stale"]:
+            raise OrderError("Prices are currently unavailable, try again later.", 503)
+
+        # Ownership of enough shares is checked inside the transaction
+        execute_sell(db.session, session["user_id"], symbol, stock["price"],
+                     shares)
+    except OrderError as error:
+        return api_error(error.message, error.code)
+
+    return jsonify({
+        "symbol": symbol,
+        "name": stock["name"],
+        "type": "sell",
+        "shares": shares,
+        "price": stock["price"]
+    })
+
+
+@app.route("/api/v1/orders", methods=["POST"])
+@api_login_required
+def api_orders():
+    """Execute basket of buys and sells all or nothing; body is JSON {"orders": [{"symbol", "type", "shares"}]}"""
+
+    body = request.get_json(silent=True)
+    orders = body.get("orders") if isinstance(body, dict) else None
+
+    if not isinstance(orders, list) or not orders:
+        return api_error("You must provide a list of orders.", 400)
+
+    if len(orders) > BASKET_MAX_ORDERS:
+        return api_error(f"At most {BASKET_MAX_ORDERS} orders are accepted at once.", 400)
+
+    # Every order gets a line in the report, errors are filled in as they are found
+    report = [{"symbol": None, "type": None, "shares": None, "status": "cancelled"} for _ in orders]
+    legs = []
+
+    for index, order in enumerate(orders):
+        try:
+            if not isinstance(order, dict):
+                raise OrderError("Order must be an object.", 400)
+
+            symbol, shares = order_request(order)
+            report[index].update(symbol=symbol, shares=shares, type=order.get("type"))
+
+            if order.get("type") not in ["buy", "sell"]:
+                raise OrderError("Order type must be buy or sell.", 400)
+        except OrderError as error:
+            report[index].update(status="rejected", error=error.message)
+            continue
+
+        legs.append({"type": order["type"], "symbol": symbol, "shares": shares})
+
+    if len(legs) < len(orders):
+        return jsonify({"error": "Some orders are invalid.", "orders": report}), 400
+
+    # Price all symbols with one concurrent fetch
+    quotes = lookup_many([leg["symbol"] for leg in legs])
+    symbols = symbol_index(wait=False)
+    code = None
+
+    for index, leg in enumerate(legs):
+        stock = quotes[leg["symbol"]]
+
+        # Without a quote the lookup failed or timed out, unless the symbol is known not to exist
+        if stock is None and leg["symbol"] not in symbols and len(symbols) > 0:
+            report[index].update(status="rejected", error="Invalid stock symbol.")
+            code = code or 400
+
+        elif stock is None:
+            report[index].update(status="rejected", error="Price is currently unavailable.")
+            code = 503
+
+        # Don't trade at last known price
+        elif stock["stale"]:
+            report[index].update(status="rejected", error="Price is currently unavailable.")
+            code = 503
+
+        else:
+            leg["stock"] = stock
+
+    if code is not None:
+        return jsonify({"error": "Some orders can't be priced.", "orders": report}), code
+
+    try:
+        execute_basket(db.session, session["user_id"], legs)
+    except LegError as error:
+        report[error.leg].update(status="rejected", error=error.message)
+        return jsonify({"error": error.message, "orders": report}), error.code
+    except OrderError as error:
+        return jsonify({"error": error.message, "orders": report}), error.code
+
+    for index, leg in enumerate(legs):
+        report[index].update(status="filled",
+                             symbol=leg["stock"]["symbol"],
+                             price=leg["stock"]["price"],
+                             total=leg["stock"]["price"] * leg["shares"])
+
+    return jsonify({"orders": report})
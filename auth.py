@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from http_client import HTTP_CONNECT_TIMEOUT, http_post
+
+HCAPTCHA_VERIFY_URL = os.environ.get("HCAPTCHA_VERIFY_URL",
+                                     "https://hcaptcha.com/siteverify")
+
+# Captcha has to be verified quickly, login is not worth blocking the worker for long
+CAPTCHA_TIMEOUT = float(os.environ.get("CAPTCHA_TIMEOUT", 3))
+
+# Hash method for new passwords, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+
+# Threads hashing passwords per worker, hashes waiting in queue and the longest wait (seconds)
+AUTH_WORKERS = int(os.environ.get("AUTH_WORKERS", 2))
+AUTH_QUEUE_SIZE = int(os.environ.get("AUTH_QUEUE_SIZE", 4))
+AUTH_TIMEOUT = float(os.environ.get("AUTH_TIMEOUT", 5))
+
+auth_executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS,
+                                   thread_name_prefix="auth")
+
+# Hashes running or queued; beyond this limit logins are rejected instead of piling up
+auth_slots = threading.BoundedSemaphore(AUTH_WORKERS + AUTH_QUEUE_SIZE)
+
+
+class AuthBusy(Exception):
+    """Too many logins are being processed right now."""
+
+
+def run_bounded(function, *args):
+    """Run function in auth executor unless it is overloaded."""
+
+    if not auth_slots.acquire(blocking=False):
+        raise AuthBusy()
+
+    # Under gevent worker threads are greenlets, so hashing would block every request of the worker
+    if threads_are_greenlets():
+        import gevent
+
+        try:
+            return gevent.get_hub().threadpool.spawn(function, *args).get(
+                timeout=AUTH_TIMEOUT)
+        except gevent.Timeout:
+            raise AuthBusy()
+        finally:
+            auth_slots.release()
+
+    future = auth_executor.submit(function, *args)
+    future.add_done_callback(lambda future: auth_slots.release())
+
+    try:
+        return future.result(timeout=AUTH_TIMEOUT)
+    except TimeoutError:
+        raise AuthBusy()
+
+
+def threads_are_greenlets():
+    """Return True if threading was monkey patched by gevent worker."""
+    gevent_monkey = sys.modules.get("gevent.monkey")
+    return gevent_monkey is not None and gevent_monkey.is_module_patched(
+        "threading")
+
+
+def hash_password(password):
+    """Hash password with configured method in auth executor."""
+    return run_bounded(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+
+def check_password(password_hash, password):
+    """Check password against hash in auth executor."""
+    return run_bounded(check_password_hash, password_hash, password)
+
+
+def verify_captcha(token):
+    """Verify hCaptcha token; raises requests.RequestException if hCaptcha is unavailable."""
+
+    response = http_post(HCAPTCHA_VERIFY_URL,
+                         data={
+                             "secret": os.environ.get("HCAPTCHA_SECRET_KEY"),
+                             "sitekey": os.environ.get("HCAPTCHA_SITE_KEY"),
+                             "response": token
+                         },
+                         timeout=(HTTP_CONNECT_TIMEOUT, CAPTCHA_TIMEOUT))
+    response.raise_for_status()
+
+    return response.json()["success"] == True
@@ -0,0 +1,214 @@
+"""Offline load test of the main routes against a seeded database and upstream stub.
+
+Seeds a fresh database with users, positions and transactions, starts gunicorn
+against the Finnhub/hCaptcha stub and reports latency percentiles and
+throughput of /, /history, /buy, /sell and /search. Exits with status 1 if
+any request failed or a route's p95 is over --max-p95, so it can run in CI.
+
+    python benchmarks/load_test.py --users 200 --positions 20 --transactions 500 --clients 16
+"""
+
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+from sqlalchemy import create_engine, text
+from werkzeug.security import generate_password_hash
+
+from stubs import start_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+
+from database import configure_engine, engine_options
+from migrations import migrate
+
+PASSWORD = "password"
+
+
+def seed(path, users, positions, transactions):
+    """Create users, each holding positions stocks with transactions orders in history."""
+    engine = create_engine("sqlite:///" + path, **engine_options())
+    configure_engine(engine, "tuned")
+    migrate(engine)
+
+    # Cheap hash, logins are not what is measured
+    password_hash = generate_password_hash(PASSWORD, "pbkdf2:sha256:1000")
+    start = datetime.now() - timedelta(days=365)
+
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO users (id, username, hash, cash) VALUES (:id, :username, :hash, 1000000)"),
+            [{"id": user, "username": f"user{user}", "hash": password_hash}
+             for user in range(1, users + 1)])
+
+        for user in range(1, users + 1):
+            connection.execute(
+                text("INSERT INTO wallet (user_id, name, symbol, shares, bought_cost, bought_shares) VALUES (:user_id, :name, :symbol, 100000, 10000000, 100000)"),
+                [{"user_id": user, "name": f"S{number} Inc", "symbol": f"S{number}"}
+                 for number in range(positions)])
+            connection.execute(
+                text("INSERT INTO transactions (user_id, name, symbol, type, price, shares, date) VALUES (:user_id, :name, :symbol, :type, :price, :shares, :date)"),
+                [{"user_id": user,
+                  "name": f"S{number % positions} Inc",
+                  "symbol": f"S{number % positions}",
+                  "type": random.choice(("buy", "sell")),
+                  "price": round(random.uniform(90, 110), 2),
+                  "shares": random.randint(1, 10),
+                  "date": start + timedelta(minutes=number)}
+                 for number in range(transactions)])
+
+    engine.dispose()
+
+
+def route_requests(base_url, positions):
+    """Return function making one request per measured route."""
+    return {
+        "/": lambda session: session.get(f"{base_url}/"),
+        "/history": lambda session: session.get(f"{base_url}/history"),
+        "/buy": lambda session: session.post(
+            f"{base_url}/buy",
+            data={"symbol": f"S{random.randrange(positions)}", "shares": "1"},
+            allow_redirects=False),
+        "/sell": lambda session: session.post(
+            f"{base_url}/sell",
+            data={"symbol": f"S{random.randrange(positions)}", "shares": "1"},
+            allow_redirects=False),
+        "/search": lambda session: session.post(
+            f"{base_url}/search",
+            data={"symbol": f"STOCK {random.randrange(1000)}"}),
+    }
+
+
+def measure(sessions, make_request, duration):
+    """Run make_request from every session for duration seconds; return latencies and failures."""
+    stop = time.monotonic() + duration
+    latencies = []
+    failures = []
+
+    def client(session):
+        while time.monotonic() < stop:
+            started = time.perf_counter()
+            try:
+                response = make_request(session)
+                if response.status_code >= 400:
+                    failures.append(response.status_code)
+            except requests.RequestException as exception:
+                failures.append(type(exception).__name__)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=client, args=(session, )) for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--positions", type=int, default=10, help="stocks held by each user (max 1000)")
+    parser.add_argument("--transactions", type=int, default=200, help="history rows of each user")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent logged-in clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per route")
+    parser.add_argument("--latency", type=float, default=50, help="upstream latency in milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of upstream requests failing with 500")
+    parser.add_argument("--rate-limit", type=int, default=None, help="upstream calls per minute before 429")
+    parser.add_argument("--worker-class", default="sync")
+    parser.add_argument("--workers", default="3")
+    parser.add_argument("--port", type=int, default=5300)
+    parser.add_argument("--max-p95", type=float, default=None, help="fail if any route p95 is over this (ms)")
+    args = parser.parse_args()
+
+    upstream, upstream_url = start_stub(args.latency / 1000, args.error_rate, args.rate_limit)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = os.path.join(directory, "finance.db")
+        started = time.perf_counter()
+        seed(database_path, args.users, args.positions, args.transactions)
+        print(f"Seeded {args.users} users x {args.positions} positions x "
+              f"{args.transactions} transactions in {time.perf_counter() - started:.1f} s")
+
+        env = dict(os.environ,
+                   DATABASE_PATH=database_path,
+                   QUOTE_CACHE_PATH=os.path.join(directory, "quote_cache.db"),
+                   RATE_LIMIT_PATH=os.path.join(directory, "quote_cache.db"),
+                   METRICS_PATH=os.path.join(directory, "quote_cache.db"),
+                   PRICE_HISTORY_PATH=os.path.join(directory, "price_history"),
+                   SYMBOLS_PATH=os.path.join(directory, "us_symbols.json.gz"),
+                   FINNHUB_URL=f"{upstream_url}/api/v1",
+                   HCAPTCHA_VERIFY_URL=f"{upstream_url}/siteverify",
+                   API_KEY="benchmark",
+                   HCAPTCHA_SITE_KEY="benchmark",
+                   HCAPTCHA_SECRET_KEY="benchmark",
+                   # Limits of the stub are the ones under test, not the app's own bucket
+                   FINNHUB_CALLS_PER_MINUTE="1000000",
+                   FINNHUB_BURST="1000000",
+                   GUNICORN_WORKER_CLASS=args.worker_class,
+                   GUNICORN_WORKERS=args.workers)
+        server = subprocess.Popen([
+            sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-b",
+            f"127.0.0.1:{args.port}", "app:app"
+        ],
+                                  cwd=ROOT,
+                                  env=env,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+        try:
+            # Wait for server, then log clients in as different users
+            for _ in range(100):
+                try:
+                    requests.get(f"{base_url}/login")
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.2)
+
+            sessions = []
+            for number in range(args.clients):
+                session = requests.Session()
+                session.post(f"{base_url}/login",
+                             data={
+                                 "h-captcha-response": "token",
+                                 "username": f"user{number % args.users + 1}",
+                                 "password": PASSWORD
+                             })
+                sessions.append(session)
+
+            print(f"{'route':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+            failed = False
+
+            for route, make_request in route_requests(base_url, args.positions).items():
+                latencies, failures = measure(sessions, make_request, args.duration)
+                quantiles = statistics.quantiles(latencies, n=100)
+                print(f"{route:<10} {len(latencies) / args.duration:>8.1f} {quantiles[49]:>8.1f} "
+                      f"{quantiles[94]:>8.1f} {quantiles[98]:>8.1f} {len(failures):>7}")
+
+                # Upstream errors are simulated on purpose, failures are only fatal without them
+                if failures and not args.error_rate and args.rate_limit is None:
+                    failed = True
+                if args.max_p95 is not None and quantiles[94] > args.max_p95:
+                    failed = True
+
+        finally:
+            server.terminate()
+            server.wait()
+            upstream.shutdown()
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
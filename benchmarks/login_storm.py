@@ -0,0 +1,136 @@
+"""Measure latency of regular pages while a storm of logins hits the app.
+
+Runs the app in a threaded server with a local captcha stub, once with
+unbounded password hashing and once with the bounded auth executor.
+
+    python benchmarks/login_storm.py [concurrent logins] [seconds]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from stubs import start_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Auth executor settings compared by the benchmark
+CONFIGS = {
+    "unbounded": {"AUTH_WORKERS": "64", "AUTH_QUEUE_SIZE": "1000"},
+    "bounded": {"AUTH_WORKERS": "1", "AUTH_QUEUE_SIZE": "2"},
+}
+
+
+def serve(port):
+    """Run app in threaded server, like a worker with many threads."""
+    sys.path.insert(0, ROOT)
+    from werkzeug.serving import make_server
+    from app import app
+
+    make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+
+def login(base_url, session=None):
+    session = session or requests.Session()
+    return session.post(f"{base_url}/login",
+                        data={
+                            "h-captcha-response": "token",
+                            "username": "storm",
+                            "password": "password"
+                        },
+                        allow_redirects=False)
+
+
+def run(name, concurrency, duration):
+    with tempfile.TemporaryDirectory() as directory:
+        captcha, captcha_url = start_stub()
+
+        port = 5100
+        env = dict(os.environ,
+                   DATABASE_PATH=os.path.join(directory, "finance.db"),
+                   QUOTE_CACHE_PATH=os.path.join(directory, "quote_cache.db"),
+                   RATE_LIMIT_PATH=os.path.join(directory, "quote_cache.db"),
+                   METRICS_PATH=os.path.join(directory, "quote_cache.db"),
+                   PRICE_HISTORY_PATH=os.path.join(directory, "price_history"),
+                   SYMBOLS_PATH=os.path.join(directory, "us_symbols.json.gz"),
+                   HCAPTCHA_VERIFY_URL=f"{captcha_url}/siteverify",
+                   API_KEY="benchmark",
+                   HCAPTCHA_SITE_KEY="benchmark",
+                   HCAPTCHA_SECRET_KEY="benchmark",
+                   **CONFIGS[name])
+        server = subprocess.Popen(
+            [sys.executable, __file__, "--serve", str(port)],
+            env=env,
+            stdout=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{port}"
+
+        try:
+            # Wait for server and create user
+            for _ in range(100):
+                try:
+                    requests.post(f"{base_url}/register",
+                                  data={
+                                      "h-captcha-response": "token",
+                                      "username": "storm",
+                                      "password": "password",
+                                      "confirmation": "password"
+                                  })
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.1)
+
+            client = requests.Session()
+            login(base_url, client)
+
+            stop = time.monotonic() + duration
+            outcomes = []
+
+            def storm():
+                while time.monotonic() < stop:
+                    outcomes.append(login(base_url).status_code)
+
+            threads = [threading.Thread(target=storm) for _ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+
+            # Regular traffic of logged-in user during the storm
+            latencies = []
+            while time.monotonic() < stop:
+                started = time.perf_counter()
+                client.get(f"{base_url}/account")
+                latencies.append((time.perf_counter() - started) * 1000)
+                time.sleep(0.05)
+
+            for thread in threads:
+                thread.join()
+
+            quantiles = statistics.quantiles(latencies, n=100)
+            print(f"{name}: /account p50 {quantiles[49]:.1f} ms, p95 {quantiles[94]:.1f} ms; "
+                  f"logins ok {outcomes.count(302)}, rejected {outcomes.count(503)}, "
+                  f"failed {len(outcomes) - outcomes.count(302) - outcomes.count(503)}")
+
+        finally:
+            server.terminate()
+            server.wait()
+            captcha.shutdown()
+
+
+def main():
+    if sys.argv[1:2] == ["--serve"]:
+        serve(int(sys.argv[2]))
+        return
+
+    concurrency, duration = (int(arg) for arg in (sys.argv[1:] + ["16", "10"])[:2])
+
+    for name in CONFIGS:
+        run(name, concurrency, duration)
+
+
+if __name__ == "__main__":
+    main()
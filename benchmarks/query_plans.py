@@ -0,0 +1,77 @@
+"""Show query plans and timings of wallet/history queries before and after schema indexes.
+
+    python benchmarks/query_plans.py [users] [positions] [transactions]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate
+
+# Queries run by routes for a single user
+QUERIES = {
+    "index wallet": "SELECT name, symbol, shares, bought_cost, bought_shares FROM wallet WHERE user_id = :user_id",
+    "sell wallet row": "SELECT name, symbol, shares FROM wallet WHERE user_id = :user_id AND symbol = :symbol",
+    "history": "SELECT * FROM transactions WHERE user_id = :user_id ORDER BY date",
+    "buys of symbol": "SELECT SUM(price * shares) FROM transactions WHERE user_id = :user_id AND symbol = :symbol AND type = 'buy'",
+}
+
+
+def seed(engine, users, positions, transactions):
+    """Fill database with users, their positions and transactions."""
+
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO users (id, username, hash) VALUES (:id, :username, '')"),
+            [{"id": user, "username": f"user{user}"} for user in range(1, users + 1)])
+        connection.execute(
+            text("INSERT INTO wallet (user_id, name, symbol, shares) VALUES (:user_id, :symbol, :symbol, 1)"),
+            [{"user_id": user, "symbol": f"S{position}"}
+             for user in range(1, users + 1) for position in range(positions)])
+        connection.execute(
+            text("INSERT INTO transactions (user_id, name, symbol, type, price, shares, date) VALUES (:user_id, :symbol, :symbol, 'buy', 10, 1, :date)"),
+            [{"user_id": user, "symbol": f"S{number % positions}", "date": f"2024-01-01 00:00:{number:06d}"}
+             for user in range(1, users + 1) for number in range(transactions)])
+
+
+def report(engine, title):
+    print(f"\n== {title} ==")
+    parameters = {"user_id": 1, "symbol": "S0"}
+
+    with engine.connect() as connection:
+        for name, query in QUERIES.items():
+            plan = connection.execute(text(f"EXPLAIN QUERY PLAN {query}"), parameters).all()
+
+            started = time.perf_counter()
+            for _ in range(100):
+                connection.execute(text(query), parameters).all()
+            elapsed = (time.perf_counter() - started) * 10
+
+            print(f"{name}: {elapsed:.3f} ms")
+            for row in plan:
+                print(f"    {row[-1]}")
+
+
+def main():
+    users, positions, transactions = (int(arg) for arg in (sys.argv[1:] + ["1000", "20", "200"])[:3])
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine("sqlite:///" + os.path.join(directory, "finance.db"))
+
+        # Schema as it was before indexes were added
+        migrate(engine, target=2)
+        seed(engine, users, positions, transactions)
+        report(engine, "before")
+
+        migrate(engine)
+        report(engine, "after")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Measure per-request overhead of session backends on a logged-in request.
+
+    python benchmarks/session_overhead.py [requests]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from flask import Flask, session
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import configure_engine, engine_options
+from migrations import migrate
+from sessions import SQLiteSessionInterface
+
+
+def make_app(backend, directory):
+    app = Flask(__name__)
+    app.config["SESSION_PERMANENT"] = False
+
+    if backend == "sqlite":
+        engine = create_engine("sqlite:///" + os.path.join(directory, "finance.db"), **engine_options())
+        configure_engine(engine)
+        migrate(engine)
+        app.session_interface = SQLiteSessionInterface(engine, 7 * 24 * 60 * 60)
+    elif backend == "cookie":
+        app.secret_key = "benchmark"
+    elif backend == "filesystem":
+        from flask_session import Session
+        app.config["SESSION_TYPE"] = "filesystem"
+        app.config["SESSION_FILE_DIR"] = os.path.join(directory, "flask_session")
+        Session(app)
+
+    @app.route("/login")
+    def login():
+        session["user_id"] = 1
+        return ""
+
+    # Like login_required routes: only reads the session
+    @app.route("/")
+    def index():
+        return str(session.get("user_id"))
+
+    return app
+
+
+def main():
+    requests = int((sys.argv[1:] + ["2000"])[0])
+
+    for backend in ["cookie", "sqlite", "filesystem"]:
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                app = make_app(backend, directory)
+            except ImportError as error:
+                print(f"{backend}: skipped ({error})")
+                continue
+
+            client = app.test_client()
+            client.get("/login")
+
+            started = time.perf_counter()
+            for _ in range(requests):
+                client.get("/")
+            elapsed = time.perf_counter() - started
+
+            print(f"{backend}: {elapsed / requests * 1e6:.0f} us per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Local stand-ins for Finnhub and hCaptcha used by benchmarks.
+
+Can also be run on its own and used by the app through FINNHUB_URL and
+HCAPTCHA_VERIFY_URL:
+
+    python benchmarks/stubs.py --port 8080 --latency 50 --error-rate 0.05 --rate-limit 60
+    FINNHUB_URL=http://127.0.0.1:8080/api/v1 HCAPTCHA_VERIFY_URL=http://127.0.0.1:8080/siteverify ...
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class UpstreamStub(BaseHTTPRequestHandler):
+    """Answer Finnhub API and hCaptcha siteverify requests like the real services."""
+
+    # Seconds added to every response
+    latency = 0.0
+
+    # Share of Finnhub requests answered with HTTP 500
+    error_rate = 0.0
+
+    # Finnhub calls allowed per minute before answering HTTP 429, None for no limit
+    rate_limit = None
+
+    _window = 0
+    _calls = 0
+    _lock = threading.Lock()
+
+    def do_GET(self):
+        time.sleep(self.latency)
+
+        if self.rate_limited():
+            self.send_json({"error": "API limit reached"}, 429,
+                           {"Retry-After": "1"})
+            return
+
+        if random.random() < self.error_rate:
+            self.send_json({"error": "internal error"}, 500)
+            return
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        symbol = query.get("symbol", [""])[0]
+
+        if url.path.endswith("/stock/profile2"):
+            self.send_json({"name": f"{symbol} Inc", "ticker": symbol})
+        elif url.path.endswith("/quote"):
+            self.send_json({"c": round(random.uniform(90, 110), 2)})
+        elif url.path.endswith("/stock/symbol"):
+            self.send_json([{
+                "symbol": f"S{number}",
+                "displaySymbol": f"S{number}",
+                "description": f"STOCK {number} INC",
+                "type": "Common Stock"
+            } for number in range(1000)])
+        elif url.path.endswith("/search"):
+            self.send_json({"result": []})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_json({"success": True})
+
+    def rate_limited(self):
+        """Count call in current minute window; return True if it is over the limit."""
+        if self.rate_limit is None:
+            return False
+
+        with self._lock:
+            window = int(time.time() // 60)
+            if window != UpstreamStub._window:
+                UpstreamStub._window = window
+                UpstreamStub._calls = 0
+            UpstreamStub._calls += 1
+            return UpstreamStub._calls > self.rate_limit
+
+    def send_json(self, data, status=200, headers={}):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(latency=0.0, error_rate=0.0, rate_limit=None, port=0):
+    """Start stub server in background thread; return server and its base URL."""
+
+    handler = type("ConfiguredUpstreamStub", (UpstreamStub, ), {
+        "latency": latency,
+        "error_rate": error_rate,
+        "rate_limit": rate_limit
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0, help="milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--rate-limit", type=int, default=None, help="calls per minute")
+    args = parser.parse_args()
+
+    server, url = start_stub(args.latency / 1000, args.error_rate,
+                             args.rate_limit, args.port)
+    print(f"Finnhub: {url}/api/v1, hCaptcha: {url}/siteverify")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Compare throughput of gunicorn worker classes on an I/O bound route.
+
+Starts gunicorn against a Finnhub stub with fixed latency and quote cache
+entries expiring at once, so every /quote waits on two upstream calls and
+goes through the SQLite files of the quote cache, rate limit and metrics.
+Also counts SQLite handles to that file held by workers at the end.
+
+    python benchmarks/worker_modes.py [concurrent clients] [seconds] [upstream latency ms]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from stubs import start_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Worker settings compared by the benchmark
+MODES = {
+    "sync": {"GUNICORN_WORKER_CLASS": "sync", "GUNICORN_WORKERS": "3"},
+    "gthread": {"GUNICORN_WORKER_CLASS": "gthread", "GUNICORN_WORKERS": "3", "GUNICORN_THREADS": "8"},
+    "gevent": {"GUNICORN_WORKER_CLASS": "gevent", "GUNICORN_WORKERS": "3"},
+}
+
+
+def run(mode, clients, duration, upstream_url):
+    with tempfile.TemporaryDirectory() as directory:
+        port = 5200
+        env = dict(os.environ,
+                   DATABASE_PATH=os.path.join(directory, "finance.db"),
+                   QUOTE_CACHE_PATH=os.path.join(directory, "quote_cache.db"),
+                   RATE_LIMIT_PATH=os.path.join(directory, "quote_cache.db"),
+                   METRICS_PATH=os.path.join(directory, "quote_cache.db"),
+                   PRICE_HISTORY_PATH=os.path.join(directory, "price_history"),
+                   SYMBOLS_PATH=os.path.join(directory, "us_symbols.json.gz"),
+                   FINNHUB_URL=f"{upstream_url}/api/v1",
+                   HCAPTCHA_VERIFY_URL=f"{upstream_url}/siteverify",
+                   API_KEY="benchmark",
+                   HCAPTCHA_SITE_KEY="benchmark",
+                   HCAPTCHA_SECRET_KEY="benchmark",
+                   QUOTE_CACHE_BACKEND="sqlite",
+                   PROFILE_CACHE_TTL="0",
+                   PRICE_CACHE_TTL="0",
+                   FINNHUB_CALLS_PER_MINUTE="1000000",
+                   FINNHUB_BURST="1000000",
+                   PRICE_REFRESHER="off",
+                   **MODES[mode])
+        server = subprocess.Popen([
+            sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "-b",
+            f"127.0.0.1:{port}", "app:app"
+        ],
+                                  cwd=ROOT,
+                                  env=env,
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        base_url = f"http://127.0.0.1:{port}"
+
+        try:
+            client = requests.Session()
+
+            # Wait for server and create user
+            for _ in range(100):
+                try:
+                    client.post(f"{base_url}/register",
+                                data={
+                                    "h-captcha-response": "token",
+                                    "username": "bench",
+                                    "password": "password",
+                                    "confirmation": "password"
+                                })
+                    break
+                except requests.ConnectionError:
+                    time.sleep(0.2)
+
+            stop = time.monotonic() + duration
+            latencies = []
+
+            def quote(number):
+                session = requests.Session()
+                session.cookies.update(client.cookies)
+                while time.monotonic() < stop:
+                    started = time.perf_counter()
+                    session.post(f"{base_url}/quote",
+                                 data={"symbol": f"S{number}"})
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+            threads = [
+                threading.Thread(target=quote, args=(number, ))
+                for number in range(clients)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            handles = open_handles(server.pid,
+                                   os.path.join(directory, "quote_cache.db"))
+            quantiles = statistics.quantiles(latencies, n=100)
+            print(f"{mode}: {len(latencies) / duration:.0f} requests/s, "
+                  f"p50 {quantiles[49]:.0f} ms, p95 {quantiles[94]:.0f} ms, "
+                  f"{handles} SQLite handles")
+
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def open_handles(pid, path):
+    """Count file descriptors of path open in child processes of pid (Linux only)."""
+    with open(f"/proc/{pid}/task/{pid}/children") as file:
+        children = file.read().split()
+
+    handles = 0
+    for child in children:
+        directory = f"/proc/{child}/fd"
+        for fd in os.listdir(directory):
+            try:
+                handles += os.readlink(os.path.join(directory, fd)) == path
+            except OSError:
+                pass
+
+    return handles
+
+
+def main():
+    clients, duration, latency = (
+        int(arg) for arg in (sys.argv[1:] + ["30", "10", "100"])[:3])
+
+    upstream, upstream_url = start_stub(latency / 1000)
+
+    for mode in MODES:
+        run(mode, clients, duration, upstream_url)
+
+    upstream.shutdown()
+
+
+if __name__ == "__main__":
+    main()
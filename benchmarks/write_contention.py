@@ -0,0 +1,76 @@
+"""Compare order throughput of concurrent writer processes with default and tuned SQLite profiles.
+
+    python benchmarks/write_contention.py [processes] [orders per process]
+"""
+
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import configure_engine, engine_options
+from migrations import migrate
+from orders import execute_buy
+
+
+def make_engine(path, profile):
+    engine = create_engine("sqlite:///" + path, **engine_options())
+    configure_engine(engine, profile)
+    return engine
+
+
+def place_orders(path, profile, user_id, orders, start):
+    """Buy one share per order, like a gunicorn worker handling /buy."""
+    engine = make_engine(path, profile)
+
+    # Start all processes at the same moment
+    while time.time() < start:
+        time.sleep(0.001)
+
+    with Session(engine) as db_session:
+        for number in range(orders):
+            stock = {"name": "Stock", "symbol": f"S{number % 10}", "price": 1.0}
+            execute_buy(db_session, user_id, stock, 1)
+
+
+def run(profile, processes, orders):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "finance.db")
+        engine = make_engine(path, profile)
+        migrate(engine)
+
+        with engine.begin() as connection:
+            connection.execute(
+                text("INSERT INTO users (id, username, hash, cash) VALUES (:id, :username, '', 1000000)"),
+                [{"id": user, "username": f"user{user}"} for user in range(processes)])
+
+        start = time.time() + 1
+        workers = [
+            multiprocessing.Process(target=place_orders,
+                                    args=(path, profile, user, orders, start))
+            for user in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        elapsed = time.time() - start
+        print(f"{profile}: {processes * orders / elapsed:.0f} orders/s ({elapsed:.2f} s)")
+
+
+def main():
+    processes, orders = (int(arg) for arg in (sys.argv[1:] + ["3", "300"])[:2])
+
+    for profile in ["default", "tuned"]:
+        run(profile, processes, orders)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class TTLCache:
+    """Thread-safe in-memory cache with time-to-live and LRU eviction."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached value for key or None if it is missing or expired."""
+        with self._lock:
+            item = self._data.get(key)
+
+            if item is None or item[0] < time.monotonic():
+                # Drop expired entry so it doesn't take place of a fresh one
+                self._data.pop(key, None)
+                self.misses += 1
+                return None
+
+            # Mark entry as recently used
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        """Store value for key; evict least recently used entries if full."""
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """Remove single entry from cache."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries from cache."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Return hit/miss counters and current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize
+            }
+
+
+class ConnectionPool:
+    """Few SQLite connections shared by all threads of the process.
+
+    Thread-local connections would be opened for every greenlet of a gevent worker
+    and never closed; here callers wait for a free connection instead.
+    """
+
+    def __init__(self, path, size=4, isolation_level=""):
+        self.path = path
+        self.size = size
+        self.isolation_level = isolation_level
+        self._idle = []
+        self._opened = 0
+        self._pid = os.getpid()
+        self._condition = threading.Condition()
+        atexit.register(self.close)
+
+    def _open(self):
+        connection = sqlite3.connect(self.path,
+                                     timeout=5,
+                                     isolation_level=self.isolation_level,
+                                     check_same_thread=False)
+        # WAL lets workers read while another one writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    @contextmanager
+    def connection(self):
+        """Borrow connection for the duration of the block."""
+        with self._condition:
+            # Connections inherited from parent process must not be used after fork
+            if self._pid != os.getpid():
+                self._idle, self._opened, self._pid = [], 0, os.getpid()
+
+            while not self._idle and self._opened >= self.size:
+                self._condition.wait()
+
+            if self._idle:
+                connection = self._idle.pop()
+            else:
+                connection = None
+                self._opened += 1
+
+        try:
+            if connection is None:
+                connection = self._open()
+            yield connection
+        except BaseException:
+            # Connection which failed to open doesn't count towards the size
+            if connection is None:
+                with self._condition:
+                    self._opened -= 1
+                    self._condition.notify()
+            raise
+        finally:
+            if connection is not None:
+                with self._condition:
+                    self._idle.append(connection)
+                    self._condition.notify()
+
+    def close(self):
+        """Close idle connections of this process."""
+        with self._condition:
+            if self._pid == os.getpid():
+                for connection in self._idle:
+                    connection.close()
+                self._opened -= len(self._idle)
+            self._idle = []
+
+
+class SQLiteCache:
+    """Cache with time-to-live stored in SQLite file shared by all workers on the host."""
+
+    # Last use of an entry is recorded at most this often, so most hits don't write (seconds)
+    touch_interval = 60
+
+    def __init__(self, path, table, maxsize, ttl):
+        self.path = path
+        self.table = table
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._pool = ConnectionPool(path)
+        self._lock = threading.Lock()
+
+        with self._pool.connection() as connection, connection:
+            connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL, used REAL NOT NULL)"
+            )
+            connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_used ON {self.table} (used)"
+            )
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        """Return cached value for key or None if it is missing or expired."""
+        now = time.time()
+
+        try:
+            with self._pool.connection() as connection:
+                row = connection.execute(
+                    f"SELECT value, used FROM {self.table} WHERE key = ? AND expires >= ?",
+                    (key, now)).fetchone()
+
+                # Remember last use for LRU eviction; expired entries are evicted first anyway
+                if row is not None and now - row[1] >= self.touch_interval:
+                    with connection:
+                        connection.execute(
+                            f"UPDATE {self.table} SET used = ? WHERE key = ?",
+                            (now, key))
+
+        except sqlite3.Error:
+            row = None
+
+        self._count(row is not None)
+        return None if row is None else json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        """Store value for key; evict expired and least recently used entries if full."""
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+
+        try:
+            # Single transaction, so other workers see either old or new entry
+            with self._pool.connection() as connection, connection:
+                connection.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, expires, used) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), expires, now))
+
+                size = connection.execute(
+                    f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+                if size > self.maxsize:
+                    connection.execute(
+                        f"DELETE FROM {self.table} WHERE expires < ?", (now, ))
+                    connection.execute(
+                        f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                        (self.maxsize, ))
+
+        except sqlite3.Error:
+            # Cache is only an optimization, failing to store value is not an error
+            pass
+
+    def invalidate(self, key):
+        """Remove single entry from cache."""
+        try:
+            with self._pool.connection() as connection, connection:
+                connection.execute(f"DELETE FROM {self.table} WHERE key = ?",
+                                   (key, ))
+        except sqlite3.Error:
+            # Entry is dropped when it expires instead
+            pass
+
+    def clear(self):
+        """Remove all entries from cache."""
+        try:
+            with self._pool.connection() as connection, connection:
+                connection.execute(f"DELETE FROM {self.table}")
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        """Return hit/miss counters of this worker and current size, None if it can't be read."""
+        try:
+            with self._pool.connection() as connection:
+                size = connection.execute(
+                    f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        except sqlite3.Error:
+            size = None
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": size,
+                "maxsize": self.maxsize
+            }
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one outstanding call."""
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, *args):
+        """Call function, or wait for result of identical call already in flight."""
+        with self._lock:
+            flight = self._flights.get(key)
+
+            if flight is None:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        # Other callers just wait for the leader and share its result
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = function(*args)
+        except BaseException as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+        return flight.result
+
+    def stats(self):
+        """Return number of performed and coalesced calls."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights)
+            }
+
+
+class _Flight:
+    """Single outstanding call of SingleFlight."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
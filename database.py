@@ -0,0 +1,52 @@
+import os
+
+from sqlalchemy import event
+
+# Pragmas applied to every new SQLite connection, "default" leaves SQLite defaults untouched
+SQLITE_PROFILES = {
+    "default": {},
+    "tuned": {
+        # Readers don't block writer and writer doesn't block readers
+        "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+        # With WAL, fsync only at checkpoints; committed data survives application crash
+        "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        # Milliseconds to wait for lock held by other worker before failing
+        "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+        "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+        # Negative value is size in KiB
+        "cache_size": int(os.environ.get("SQLITE_CACHE_SIZE", -16000)),
+        "temp_store": "MEMORY"
+    }
+}
+
+SQLITE_PROFILE = os.environ.get("SQLITE_PROFILE", "tuned")
+
+# Connections kept per worker; SQLite allows only one writer anyway
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 5))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+
+
+def engine_options():
+    """Return SQLAlchemy engine options for SQLite database file."""
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT
+    }
+
+
+def configure_engine(engine, profile=SQLITE_PROFILE):
+    """Apply pragmas of profile to every new connection of engine."""
+
+    if profile not in SQLITE_PROFILES:
+        raise RuntimeError(f"Unknown SQLite profile: {profile}")
+
+    pragmas = SQLITE_PROFILES[profile]
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
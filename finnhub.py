@@ -0,0 +1,105 @@
+import os
+
+import requests
+
+from http_client import http_get
+from ratelimit import CircuitBreaker, TokenBucket
+
+FINNHUB_URL = os.environ.get("FINNHUB_URL", "https://finnhub.io/api/v1")
+
+# Finnhub free tier allows 60 calls per minute, bucket is shared by all workers on the host
+FINNHUB_CALLS_PER_MINUTE = float(os.environ.get("FINNHUB_CALLS_PER_MINUTE", 60))
+FINNHUB_BURST = float(os.environ.get("FINNHUB_BURST", 10))
+FINNHUB_MAX_WAIT = float(os.environ.get("FINNHUB_MAX_WAIT", 2))
+RATE_LIMIT_PATH = os.environ.get(
+    "RATE_LIMIT_PATH",
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), "quote_cache.db"))
+
+# Consecutive failures which open the circuit and how long it stays open (seconds)
+FINNHUB_FAILURE_THRESHOLD = int(os.environ.get("FINNHUB_FAILURE_THRESHOLD", 5))
+FINNHUB_RESET_TIMEOUT = float(os.environ.get("FINNHUB_RESET_TIMEOUT", 30))
+
+rate_limiter = TokenBucket(RATE_LIMIT_PATH, "finnhub",
+                           FINNHUB_CALLS_PER_MINUTE / 60, FINNHUB_BURST)
+breaker = CircuitBreaker(FINNHUB_FAILURE_THRESHOLD, FINNHUB_RESET_TIMEOUT)
+
+# Number of 429 responses received by this worker
+rate_limited = 0
+
+
+class UpstreamUnavailable(requests.RequestException):
+    """Finnhub call was not made because of rate limit or open circuit."""
+
+
+def take_token(remaining):
+    """Check circuit breaker and take rate limit token before every attempt of a call."""
+
+    if not breaker.allow():
+        raise UpstreamUnavailable("Finnhub circuit is open")
+
+    if not rate_limiter.acquire(min(FINNHUB_MAX_WAIT, remaining)):
+        raise UpstreamUnavailable("Finnhub rate limit exceeded")
+
+
+def finnhub_get(path, **params):
+    """Call Finnhub API endpoint respecting rate limit and circuit breaker."""
+    global rate_limited
+
+    params["token"] = os.environ.get("API_KEY")
+
+    try:
+        # Retries take tokens too, so they count against the rate limit
+        response = http_get(f"{FINNHUB_URL}/{path}",
+                            before_attempt=take_token,
+                            params=params)
+    except UpstreamUnavailable:
+        raise
+    except requests.RequestException:
+        breaker.record_failure()
+        raise
+
+    if response.status_code == 429:
+        rate_limited += 1
+
+        # Pause all workers for as long as Finnhub asks
+        try:
+            retry_after = float(response.headers.get("Retry-After", 60))
+        except ValueError:
+            retry_after = 60
+        rate_limiter.block(retry_after)
+        breaker.record_failure()
+
+    elif response.status_code >= 500:
+        breaker.record_failure()
+
+    else:
+        breaker.record_success()
+
+    response.raise_for_status()
+    return response
+
+
+def is_degraded():
+    """Return True if Finnhub is currently considered unhealthy."""
+    return breaker.is_open()
+
+
+def finnhub_stats():
+    """Return rate limiter and circuit breaker counters."""
+    return {
+        "rate_limited": rate_limited,
+        "rate_limiter": rate_limiter.stats(),
+        "breaker": breaker.stats()
+    }
+
+
+def finnhub_samples():
+    """Return upstream error counters of this worker as metric samples."""
+    stats = finnhub_stats()
+    return [
+        ("finnhub_rate_limited_total", {}, stats["rate_limited"]),
+        ("finnhub_throttled_total", {}, stats["rate_limiter"]["throttled"]),
+        ("finnhub_rejected_total", {"reason": "rate_limit"}, stats["rate_limiter"]["rejected"]),
+        ("finnhub_rejected_total", {"reason": "circuit_open"}, stats["breaker"]["rejected"]),
+        ("finnhub_circuit_trips_total", {}, stats["breaker"]["trips"])
+    ]
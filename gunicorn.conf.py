@@ -1,2 +1,34 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+
 bind = "0.0.0.0:5000"
-workers = 3
\ No newline at end of file
+
+# "sync" serves one request per worker at a time, "gthread" one per thread,
+# "gevent" many concurrent requests per worker while they wait on Finnhub or hCaptcha
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+workers = int(
+    os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+# More than one thread turns sync workers into gthread, so threads are used only when asked for
+threads = int(
+    os.environ.get("GUNICORN_THREADS", 4 if worker_class == "gthread" else 1))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 200))
+
+# Background process downloading the symbol list, compacting price history and,
+# unless PRICE_REFRESHER is off, keeping prices of held symbols warm in the shared quote cache
+refresher = None
+
+
+def when_ready(server):
+    global refresher
+
+    refresher = subprocess.Popen([
+        sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "refresher.py")
+    ])
+
+
+def on_exit(server):
+    if refresher is not None:
+        refresher.terminate()
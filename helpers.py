@@ -1,11 +1,68 @@
+import hashlib
+import json
 import os
 import requests
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 
-from flask import redirect, render_template, request, session
+from flask import Response, g, has_request_context, jsonify, redirect, render_template, request, session
 from functools import wraps
 
+from cache import SingleFlight, SQLiteCache, TTLCache
+from finnhub import finnhub_get
+from metrics import carry_timings
+from pricehistory import PriceHistory
+from symbols import symbol_index
+
+# Number of concurrent quote requests per worker and deadline for a whole batch (seconds)
+LOOKUP_MAX_WORKERS = int(os.environ.get("LOOKUP_MAX_WORKERS", 8))
+LOOKUP_BATCH_TIMEOUT = float(os.environ.get("LOOKUP_BATCH_TIMEOUT", 5))
+
+# Company profiles rarely change, prices are kept only for a few seconds
+PROFILE_CACHE_TTL = float(os.environ.get("PROFILE_CACHE_TTL", 24 * 60 * 60))
+PRICE_CACHE_TTL = float(os.environ.get("PRICE_CACHE_TTL", 5))
+QUOTE_CACHE_SIZE = int(os.environ.get("QUOTE_CACHE_SIZE", 2048))
+
+# Last known prices are served while Finnhub is unavailable
+LAST_PRICE_TTL = float(os.environ.get("LAST_PRICE_TTL", 7 * 24 * 60 * 60))
+
+# "sqlite" cache is shared by all gunicorn workers on the host, "memory" is per worker
+QUOTE_CACHE_BACKEND = os.environ.get("QUOTE_CACHE_BACKEND", "sqlite")
+QUOTE_CACHE_PATH = os.environ.get(
+    "QUOTE_CACHE_PATH",
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), "quote_cache.db"))
+
+
+def make_cache(name, ttl):
+    """Create quote cache using configured backend."""
+
+    if QUOTE_CACHE_BACKEND == "sqlite":
+        return SQLiteCache(QUOTE_CACHE_PATH, name, QUOTE_CACHE_SIZE, ttl)
+    elif QUOTE_CACHE_BACKEND == "memory":
+        return TTLCache(QUOTE_CACHE_SIZE, ttl)
+
+    raise RuntimeError(f"Unknown quote cache backend: {QUOTE_CACHE_BACKEND}")
+
+
+# Every fetched price is appended to history of its symbol
+PRICE_HISTORY_PATH = os.environ.get(
+    "PRICE_HISTORY_PATH",
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), "price_history"))
+
+profile_cache = make_cache("profile", PROFILE_CACHE_TTL)
+price_cache = make_cache("price", PRICE_CACHE_TTL)
+last_price_cache = make_cache("last_price", LAST_PRICE_TTL)
+
+# Concurrent lookups of the same symbol share one api request
+quote_flight = SingleFlight()
+
+price_history = PriceHistory(PRICE_HISTORY_PATH)
+
+# Bounded thread pool shared by all batch lookups in this worker
+lookup_executor = ThreadPoolExecutor(max_workers=LOOKUP_MAX_WORKERS,
+                                     thread_name_prefix="lookup")
+
 
 def check_env_vars(vars_list):
     # Create a list of environment variables that are not set
@@ -39,59 +96,286 @@ def login_required(f):
     return decorated_function
 
 
-def lookup(symbol):
-    """Look up quote for symbol."""
+def api_login_required(f):
+    """Decorate API routes to require login, answering 401 instead of redirecting."""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get("user_id") is None:
+            return api_error("Login required.", 401)
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def api_error(message, code=400):
+    """Return error message as JSON."""
+    return jsonify({"error": message}), code
+
+
+def weak_etag(*state):
+    """Return ETag identifying state values."""
+    return hashlib.blake2b(json.dumps(state, default=str).encode(),
+                           digest_size=12).hexdigest()
+
+
+def cached_json(payload, cache_control, etag=None):
+    """Return payload as JSON with Cache-Control and weak ETag, or 304 if client has it already.
+
+    Without etag it is derived from payload itself.
+    """
+
+    if etag is None:
+        etag = weak_etag(payload)
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(payload)
+
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
+
+def per_request(f):
+    """Memoize results of function in flask.g for the duration of one request."""
+
+    @wraps(f)
+    def decorated_function(*args):
+        # Threads of batch lookups work outside of request, so nothing to memoize
+        if not has_request_context():
+            return f(*args)
+
+        memo = g.setdefault("memo", {})
+        key = (f.__name__, ) + args
+        if key not in memo:
+            memo[key] = f(*args)
+        return memo[key]
+
+    return decorated_function
+
+
+def get_profile(symbol):
+    """Get company profile for symbol, cached for PROFILE_CACHE_TTL."""
+
+    profile = profile_cache.get(symbol)
+    if profile is not None:
+        return profile
+
+    return quote_flight.do(("profile", symbol), fetch_profile, symbol)
+
+
+def fetch_profile(symbol):
+    """Fetch company profile for symbol from API and store it in cache."""
 
     # Contact API
     try:
-        API_KEY = os.environ.get("API_KEY")
         # https://finnhub.io/docs/api/company-profile2
-        profile2_url = f"https://finnhub.io/api/v1/stock/profile2?symbol={symbol}&token={API_KEY}"
+        profile2_response = finnhub_get("stock/profile2", symbol=symbol)
 
-        # https://finnhub.io/docs/api/quote
-        quote_url = f"https://finnhub.io/api/v1/quote?symbol={symbol}&token={API_KEY}"
+    except requests.RequestException:
+        return None
+
+    # Parse response
+    try:
+        profile2 = profile2_response.json()
+        profile = {"name": profile2["name"], "symbol": profile2["ticker"]}
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    profile_cache.set(symbol, profile)
+    return profile
+
+
+def get_price(symbol):
+    """Get current price for symbol, cached for PRICE_CACHE_TTL."""
+
+    price = price_cache.get(symbol)
+    if price is not None:
+        return price
 
-        profile2_response = requests.get(profile2_url)
-        profile2_response.raise_for_status()
+    return quote_flight.do(("price", symbol), fetch_price, symbol)
 
-        quote_response = requests.get(quote_url)
-        quote_response.raise_for_status()
+
+def fetch_price(symbol, ttl=None):
+    """Fetch current price for symbol from API and store it in cache."""
+
+    # Contact API
+    try:
+        # https://finnhub.io/docs/api/quote
+        quote_response = finnhub_get("quote", symbol=symbol)
 
     except requests.RequestException:
         return None
 
     # Parse response
     try:
-        profile2 = profile2_response.json()
-        quote = quote_response.json()
-        return {
-            "name": profile2["name"],
-            "price": float(quote["c"]),
-            "symbol": profile2["ticker"]
-        }
+        price = float(quote_response.json()["c"])
     except (KeyError, TypeError, ValueError):
         return None
 
+    price_cache.set(symbol, price, ttl)
+    last_price_cache.set(symbol, price)
+
+    # History is a side product, quote must not fail because of it
+    try:
+        price_history.append(symbol, price)
+    except OSError:
+        pass
+
+    return price
+
+
+def lookup(symbol):
+    """Look up quote for symbol."""
+
+    # Symbols are cached in upper case
+    return lookup_symbol(symbol.upper())
+
+
+@per_request
+def lookup_symbol(symbol):
+    """Look up quote for upper case symbol."""
+
+    # Profile is checked first, so invalid symbols don't cost a quote request
+    profile = get_profile(symbol)
+    if profile is None:
+        return None
+
+    price = get_price(symbol)
+    stale = False
+
+    # Finnhub is unhealthy or rate limited, fall back to last known price
+    if price is None:
+        price = last_price_cache.get(symbol)
+        stale = True
+
+    if price is None:
+        return None
+
+    return {
+        "name": profile["name"],
+        "price": price,
+        "symbol": profile["symbol"],
+        "stale": stale
+    }
+
+
+def invalidate_quote(symbol=None):
+    """Drop cached profile and price for symbol, or for all symbols if None."""
+
+    if symbol is None:
+        profile_cache.clear()
+        price_cache.clear()
+    else:
+        profile_cache.invalidate(symbol.upper())
+        price_cache.invalidate(symbol.upper())
+
+
+def quote_cache_stats():
+    """Return hit/miss counters of quote caches and coalesced api calls."""
+    return {
+        "profile": profile_cache.stats(),
+        "price": price_cache.stats(),
+        "last_price": last_price_cache.stats(),
+        "flight": quote_flight.stats()
+    }
+
+
+def quote_cache_samples():
+    """Return quote cache counters of this worker as metric samples."""
+    stats = quote_cache_stats()
+    samples = []
+
+    for cache in ("profile", "price", "last_price"):
+        samples.append(("quote_cache_hits_total", {"cache": cache}, stats[cache]["hits"]))
+        samples.append(("quote_cache_misses_total", {"cache": cache}, stats[cache]["misses"]))
 
+    samples.append(("quote_flight_calls_total", {}, stats["flight"]["calls"]))
+    samples.append(("quote_flight_coalesced_total", {}, stats["flight"]["coalesced"]))
+    return samples
+
+
+def lookup_many(symbols, timeout=LOOKUP_BATCH_TIMEOUT):
+    """Look up quotes for many symbols concurrently.
+
+    Returns dictionary mapping each symbol to its quote, or to None if the
+    lookup failed or did not finish before the batch deadline.
+    """
+
+    # Skip duplicated symbols but keep their order
+    symbols = list(dict.fromkeys(symbols))
+
+    # Fan out all lookups over the thread pool
+    futures = {
+        symbol: lookup_executor.submit(carry_timings(lookup), symbol)
+        for symbol in symbols
+    }
+
+    # Wait for all quotes, but no longer than the batch deadline
+    done, not_done = wait(futures.values(), timeout=timeout)
+
+    quotes = {}
+    for symbol, future in futures.items():
+        if future in done:
+            quotes[symbol] = future.result()
+        else:
+            # Don't start lookups which are still queued after the deadline
+            future.cancel()
+            quotes[symbol] = None
+
+    return quotes
+
+
+def refresh_prices(symbols, ttl=None):
+    """Fetch current prices of symbols concurrently and store them in cache.
+
+    Returns number of refreshed prices.
+    """
+
+    symbols = [symbol.upper() for symbol in symbols]
+
+    # Profiles are fetched only when they are not cached already
+    for symbol in symbols:
+        get_profile(symbol)
+
+    prices = lookup_executor.map(lambda symbol: fetch_price(symbol, ttl),
+                                 symbols)
+    return sum(1 for price in prices if price is not None)
+
+
+def current_prices(symbols):
+    """Get prices of symbols concurrently through the price cache, skipping unavailable ones."""
+
+    prices = lookup_executor.map(get_price, symbols)
+    return {
+        symbol: price
+        for symbol, price in zip(symbols, prices) if price is not None
+    }
+
+
+@per_request
 def search(symbol):
     """Search for best-matching symbols"""
     """US market only"""
 
-    # Contact API
-    try:
-        API_KEY = os.environ.get("API_KEY")
+    # Search locally stored US symbols, without contacting API
+    us_symbols = symbol_index()
+    if len(us_symbols) > 0:
+        return us_symbols.search(symbol)
 
-        # https://finnhub.io/docs/api/symbol-search
-        search_url = f"https://finnhub.io/api/v1/search?q={symbol}&token={API_KEY}"
+    # Local symbol list is not available yet, use API instead (results may include non-US symbols)
+    return search_remote(symbol)
 
-        search_response = requests.get(search_url)
-        search_response.raise_for_status()
 
-        # https://finnhub.io/docs/api/stock-symbols
-        stock_symbols_url = f"https://finnhub.io/api/v1/stock/symbol?exchange=US&token={API_KEY}"
+def search_remote(symbol):
+    """Search for best-matching symbols using API"""
 
-        stock_symbols_response = requests.get(stock_symbols_url)
-        stock_symbols_response.raise_for_status()
+    # Contact API
+    try:
+        # https://finnhub.io/docs/api/symbol-search
+        search_response = finnhub_get("search", q=symbol)
 
     except requests.RequestException:
         return None
@@ -99,18 +383,7 @@ def search(symbol):
     # Parse response
     try:
         search = search_response.json()
-        stock_symbols = stock_symbols_response.json()
-
-        # Extract symbols from stock_symbols
-        stock_symbols_list = [symbol["symbol"] for symbol in stock_symbols]
-
-        # Filter search results to only include symbols that are in stock_symbols_list
-        filtered_search = [
-            item for item in search["result"]
-            if item["symbol"] in stock_symbols_list
-        ]
-
-        return filtered_search
+        return search["result"]
 
     except (KeyError, TypeError, ValueError):
         return None
@@ -0,0 +1,106 @@
+import os
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import record_upstream
+
+# Timeouts for establishing connection and for waiting on response (seconds)
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 5))
+
+# Total time of one GET request including retries; lookup makes two in a row,
+# so both together stay within gunicorn timeout (seconds)
+HTTP_DEADLINE = float(os.environ.get("HTTP_DEADLINE", 10))
+
+# Number of kept-alive connections per host and retries of failed GET requests
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 16))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 2))
+HTTP_BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", 0.3))
+
+# Statuses of GET responses which are retried
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+
+def make_session():
+    """Create session with connection pooling; retries are done by http_get."""
+
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                          pool_maxsize=HTTP_POOL_SIZE,
+                          max_retries=0)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Session shared by all threads of the worker, so connections are reused between requests
+http_session = make_session()
+
+
+def http_get(url, before_attempt=None, **kwargs):
+    """Send GET request using shared session, retrying failures until HTTP_DEADLINE.
+
+    before_attempt is called with the remaining seconds before every attempt,
+    e.g. to take a rate limit token; it may raise to stop the call.
+    """
+
+    deadline = time.monotonic() + HTTP_DEADLINE
+    failure = requests.Timeout(f"No time left to call {url}")
+
+    for attempt in range(HTTP_RETRIES + 1):
+        # Back off before retry, but never past the deadline; Retry-After is not waited for
+        if attempt > 0:
+            delay = HTTP_BACKOFF_FACTOR * 2**(attempt - 1)
+            if time.monotonic() + delay >= deadline:
+                break
+            time.sleep(delay)
+
+        if before_attempt is not None:
+            before_attempt(deadline - time.monotonic())
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        try:
+            response = timed_request(http_session.get,
+                                     url,
+                                     timeout=(min(HTTP_CONNECT_TIMEOUT, remaining),
+                                              min(HTTP_READ_TIMEOUT, remaining)),
+                                     **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as error:
+            failure = error
+            continue
+
+        if response.status_code not in RETRY_STATUSES:
+            return response
+        failure = response
+
+    # Last failed response is returned like any other, errors are raised
+    if isinstance(failure, requests.Response):
+        return failure
+    raise failure
+
+
+def http_post(url, **kwargs):
+    """Send POST request using shared session with default timeouts."""
+    return timed_request(http_session.post, url, **kwargs)
+
+
+def timed_request(send, url, **kwargs):
+    """Send request and record its status and duration in metrics."""
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    started = time.perf_counter()
+    status = "error"
+
+    try:
+        response = send(url, **kwargs)
+        status = response.status_code
+        return response
+    finally:
+        record_upstream(urlparse(url).netloc, status,
+                        time.perf_counter() - started)
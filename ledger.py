@@ -0,0 +1,269 @@
+from datetime import date
+
+import numpy as np
+from sqlalchemy import text
+
+from cache import TTLCache
+
+
+class LedgerState:
+    """Daily holdings and cash of one user replayed from transactions and deposits.
+
+    Column i of holdings, cash and trade_prices is the end of day first_day + i.
+    """
+
+    def __init__(self, symbols, first_day, holdings, cash, trade_prices,
+                 last_orderid, last_deposit_id):
+        self.symbols = symbols
+        self.first_day = first_day
+        self.holdings = holdings
+        self.cash = cash
+        self.trade_prices = trade_prices
+        self.last_orderid = last_orderid
+        self.last_deposit_id = last_deposit_id
+
+    @property
+    def last_day(self):
+        return self.first_day + self.cash.shape[0] - 1
+
+
+class LedgerEngine:
+    """Replay ledgers into daily account value, cached per user and extended incrementally."""
+
+    def __init__(self, history, maxsize, ttl):
+        self.history = history
+        self._states = TTLCache(maxsize, ttl)
+        self.full_replays = 0
+        self.tail_replays = 0
+
+    def state(self, db_session, user_id, today=None):
+        """Return ledger state of user up to today, replaying only events not seen before."""
+        # Ledger dates are stored in local time, so days are counted in local time too
+        if today is None:
+            today = (date.today() - date(1970, 1, 1)).days
+
+        # Orderids and deposit ids only grow, so they tell which events are new
+        last_orderid, last_deposit_id, cash = db_session.execute(
+            text(
+                "SELECT (SELECT COALESCE(MAX(orderid), 0) FROM transactions WHERE user_id = :user_id), "
+                "(SELECT COALESCE(MAX(id), 0) FROM cash_deposits WHERE user_id = :user_id), "
+                "(SELECT cash FROM users WHERE id = :user_id)"), {
+                    "user_id": user_id
+                }).one()
+
+        state = self._states.get(user_id)
+
+        # Ledger without events starts on the day it was replayed, a full replay starts it on the first event
+        if state is not None and (state.last_orderid, state.last_deposit_id) == (0, 0):
+            state = None
+
+        if state is None:
+            state = self._replay(db_session, user_id, cash, today)
+            self.full_replays += 1
+
+        elif (state.last_orderid, state.last_deposit_id) != (last_orderid, last_deposit_id):
+            state = self._replay_tail(db_session, user_id, state, today)
+            self.tail_replays += 1
+
+        elif state.last_day < today:
+            state = extend(state, today)
+
+        self._states.set(user_id, state)
+        return state
+
+    def invalidate(self, user_id):
+        self._states.invalidate(user_id)
+
+    def value_series(self, db_session, user_id, days, today=None):
+        """Return dates and daily cash, stock value and total value of user over last days."""
+        state = self.state(db_session, user_id, today)
+
+        # Only the requested window is joined with prices
+        start = max(0, state.cash.shape[0] - days)
+        grid = np.arange(state.first_day + start, state.last_day + 1, dtype=np.int64)
+        holdings = state.holdings[:, start:]
+        cash = state.cash[start:]
+
+        # Stored closes where known, otherwise last traded price of the user
+        closes = self.history.close_matrix(state.symbols, grid)
+        prices = np.where(np.isnan(closes), state.trade_prices[:, start:], closes)
+
+        # Held shares without any known price are left out of the value
+        stock_value = np.nansum(holdings * prices, axis=0)
+
+        return {
+            "dates": grid.astype("datetime64[D]").astype(str).tolist(),
+            "cash": cash.tolist(),
+            "stock_value": stock_value.tolist(),
+            "value": (cash + stock_value).tolist()
+        }
+
+    def stats(self):
+        """Return cache counters and number of full and incremental replays."""
+        return dict(self._states.stats(),
+                    full_replays=self.full_replays,
+                    tail_replays=self.tail_replays)
+
+    def _replay(self, db_session, user_id, cash, today):
+        """Replay whole ledger of user."""
+        trades, deposits = fetch_events(db_session, user_id, 0, 0)
+
+        event_days = np.concatenate([trades["day"], deposits["day"]])
+        first_day = int(min(event_days.min(), today)) if len(event_days) else today
+
+        symbols = list(dict.fromkeys(trades["symbol"].tolist()))
+        size = today - first_day + 1
+
+        flows, cash_flows, prices = event_matrices(symbols, first_day, size,
+                                                   trades, deposits)
+
+        # Cash before the first recorded event, e.g. cash given at registration
+        opening_cash = float(cash) - cash_flows.sum()
+
+        return LedgerState(symbols, first_day,
+                           np.cumsum(flows, axis=1),
+                           opening_cash + np.cumsum(cash_flows),
+                           forward_fill(prices),
+                           last_id(trades["orderid"]),
+                           last_id(deposits["id"]))
+
+    def _replay_tail(self, db_session, user_id, state, today):
+        """Apply events newer than state from the day of the first of them."""
+        trades, deposits = fetch_events(db_session, user_id,
+                                        state.last_orderid,
+                                        state.last_deposit_id)
+        state = extend(state, today)
+
+        # Symbols bought for the first time get new rows
+        symbols = state.symbols + [
+            symbol for symbol in dict.fromkeys(trades["symbol"].tolist())
+            if symbol not in state.symbols
+        ]
+        added = len(symbols) - len(state.symbols)
+        size = state.cash.shape[0]
+
+        holdings = np.vstack([state.holdings, np.zeros((added, size))])
+        trade_prices = np.vstack([state.trade_prices, np.full((added, size), np.nan)])
+        cash = state.cash.copy()
+
+        # New events are never older than the replayed ones, so only the tail changes
+        event_days = np.concatenate([trades["day"], deposits["day"]])
+        if len(event_days) == 0:
+            return state
+
+        start = int(max(event_days.min(), state.first_day)) - state.first_day
+
+        flows, cash_flows, prices = event_matrices(symbols,
+                                                   state.first_day + start,
+                                                   size - start, trades,
+                                                   deposits)
+
+        holdings[:, start:] += np.cumsum(flows, axis=1)
+        cash[start:] += np.cumsum(cash_flows)
+
+        # From the first new trade of a symbol on, its new prices replace the old ones
+        new_prices = forward_fill(prices)
+        trade_prices[:, start:] = np.where(np.isnan(new_prices),
+                                           trade_prices[:, start:], new_prices)
+
+        return LedgerState(symbols, state.first_day, holdings, cash,
+                           trade_prices,
+                           max(state.last_orderid, last_id(trades["orderid"])),
+                           max(state.last_deposit_id, last_id(deposits["id"])))
+
+
+def fetch_events(db_session, user_id, after_orderid, after_deposit_id):
+    """Return trades and deposits of user newer than given ids as dictionaries of arrays."""
+    trades = db_session.execute(
+        text(
+            "SELECT orderid, symbol, type, price, shares, date FROM transactions WHERE user_id = :user_id AND orderid > :after ORDER BY orderid"
+        ), {
+            "user_id": user_id,
+            "after": after_orderid
+        }).all()
+    deposits = db_session.execute(
+        text(
+            "SELECT id, amount, date FROM cash_deposits WHERE user_id = :user_id AND id > :after ORDER BY id"
+        ), {
+            "user_id": user_id,
+            "after": after_deposit_id
+        }).all()
+
+    orderid, symbol, kind, price, shares, trade_date = (
+        list(column) for column in zip(*trades)) if trades else ([], ) * 6
+    deposit_id, amount, deposit_date = (
+        list(column) for column in zip(*deposits)) if deposits else ([], ) * 3
+
+    # Sells take shares out of the account; cash flow is always the opposite of shares times price
+    sign = np.where(np.array(kind, dtype=object) == "sell", -1.0, 1.0)
+
+    return {
+        "orderid": np.array(orderid, dtype=np.int64),
+        "symbol": np.array(symbol, dtype=object),
+        "shares": sign * np.array(shares, dtype=float),
+        "price": np.array(price, dtype=float),
+        "day": to_days(trade_date)
+    }, {
+        "id": np.array(deposit_id, dtype=np.int64),
+        "amount": np.array(amount, dtype=float),
+        "day": to_days(deposit_date)
+    }
+
+
+def event_matrices(symbols, first_day, size, trades, deposits):
+    """Return daily share flows, cash flows and last trade prices of events from first_day on."""
+    # Row of every trade's symbol, looked up in sorted symbols
+    names = np.array(symbols, dtype=object)
+    order = np.argsort(names)
+    rows = order[np.searchsorted(names[order], trades["symbol"])].astype(np.int64)
+    columns = trades["day"] - first_day
+    deposit_columns = deposits["day"] - first_day
+
+    flows = np.zeros((len(symbols), size))
+    np.add.at(flows, (rows, columns), trades["shares"])
+
+    cash_flows = np.zeros(size)
+    np.add.at(cash_flows, columns, -trades["shares"] * trades["price"])
+    np.add.at(cash_flows, deposit_columns, deposits["amount"])
+
+    # Trades are ordered by orderid; the last one of a symbol and day is the first one of reversed keys
+    prices = np.full((len(symbols), size), np.nan)
+    keys = rows * size + columns
+    _, reversed_index = np.unique(keys[::-1], return_index=True)
+    last = len(keys) - 1 - reversed_index
+    prices[rows[last], columns[last]] = trades["price"][last]
+
+    return flows, cash_flows, prices
+
+
+def extend(state, today):
+    """Carry last day of state forward up to today."""
+    missing = today - state.last_day
+    if missing <= 0:
+        return state
+
+    return LedgerState(
+        state.symbols, state.first_day,
+        np.hstack([state.holdings, np.repeat(state.holdings[:, -1:], missing, axis=1)]),
+        np.concatenate([state.cash, np.repeat(state.cash[-1:], missing)]),
+        np.hstack([state.trade_prices, np.repeat(state.trade_prices[:, -1:], missing, axis=1)]),
+        state.last_orderid, state.last_deposit_id)
+
+
+def forward_fill(matrix):
+    """Replace NaN in every row with the last value before it."""
+    if matrix.size == 0:
+        return matrix
+
+    index = np.where(np.isnan(matrix), 0, np.arange(matrix.shape[1]))
+    np.maximum.accumulate(index, axis=1, out=index)
+    return matrix[np.arange(matrix.shape[0])[:, None], index]
+
+
+def to_days(dates):
+    """Convert stored dates like "2024-01-31 12:00:00.000000" to days since epoch."""
+    return np.array(dates, dtype="datetime64[us]").astype("datetime64[D]").astype(np.int64)
+
+
+def last_id(ids):
+    return int(ids.max()) if len(ids) else 0
@@ -0,0 +1,291 @@
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+from cache import ConnectionPool
+from flask import before_render_template, request, template_rendered
+from sqlalchemy import event
+
+# Counters of every process are written to SQLite file shared by all workers on the host
+METRICS_PATH = os.environ.get(
+    "METRICS_PATH",
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), "quote_cache.db"))
+
+# How often each process publishes its counters (seconds)
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", 5))
+
+# Processes which haven't published counters for this long are finished, their counters
+# are folded into one aggregate row per counter (seconds)
+METRICS_RETIRE_AFTER = float(os.environ.get("METRICS_RETIRE_AFTER", 10 * 60))
+
+# Upper bounds of request duration histogram buckets (seconds)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Metrics recorded with Metrics.observe, the rest are counters
+HISTOGRAMS = {"http_request_duration_seconds"}
+
+# Time spent by current request in SQL, outbound HTTP and templates
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+class Metrics:
+    """Counters of this process, periodically published to SQLite file and summed on read."""
+
+    def __init__(self, path, flush_interval, retire_after):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.retire_after = retire_after
+        self._values = {}
+        self._collectors = []
+        self._flusher = None
+        self._lock = threading.Lock()
+        self._pool = ConnectionPool(path)
+
+        # Counters of finished workers are folded into "finished" rows, so summed counters never go down
+        self.worker = f"{os.getpid()}-{time.time():.6f}"
+
+        with self._pool.connection() as connection, connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS metrics (worker TEXT NOT NULL, name TEXT NOT NULL, labels TEXT NOT NULL, value REAL NOT NULL, PRIMARY KEY (worker, name, labels))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS metrics_workers (worker TEXT PRIMARY KEY NOT NULL, seen REAL NOT NULL)"
+            )
+
+    def inc(self, name, value=1, **labels):
+        """Add value to counter."""
+        key = (name, format_labels(labels))
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+        self.start_flusher()
+
+    def observe(self, name, value, **labels):
+        """Record value in histogram with DURATION_BUCKETS."""
+        with self._lock:
+            for bound in DURATION_BUCKETS + ("+Inf", ):
+                if bound == "+Inf" or value <= bound:
+                    key = (f"{name}_bucket", format_labels(dict(labels, le=bound)))
+                    self._values[key] = self._values.get(key, 0) + 1
+
+            for suffix, amount in (("_sum", value), ("_count", 1)):
+                key = (f"{name}{suffix}", format_labels(labels))
+                self._values[key] = self._values.get(key, 0) + amount
+
+        self.start_flusher()
+
+    def register_collector(self, collector):
+        """Add function returning (name, labels, value) of counters kept elsewhere in this process."""
+        self._collectors.append(collector)
+
+    def start_flusher(self):
+        """Start thread publishing counters, on first use so it runs in worker and not in master."""
+        if self._flusher is not None:
+            return
+
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_forever,
+                                                 name="metrics",
+                                                 daemon=True)
+                self._flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Publish current counters of this process."""
+        with self._lock:
+            rows = [(self.worker, name, labels, value)
+                    for (name, labels), value in self._values.items()]
+
+        for collector in self._collectors:
+            rows += [(self.worker, name, format_labels(labels), value)
+                     for name, labels, value in collector()]
+
+        now = time.time()
+
+        try:
+            with self._pool.connection() as connection, connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO metrics (worker, name, labels, value) VALUES (?, ?, ?, ?)",
+                    rows)
+                connection.execute(
+                    "INSERT OR REPLACE INTO metrics_workers (worker, seen) VALUES (?, ?)",
+                    (self.worker, now))
+                retire_finished(connection, now - self.retire_after)
+        except sqlite3.Error:
+            # Metrics are not worth failing a request
+            pass
+
+    def render(self):
+        """Return counters of all processes in Prometheus text format."""
+        self.flush()
+
+        with self._pool.connection() as connection:
+            rows = connection.execute(
+                "SELECT name, labels, SUM(value) FROM metrics GROUP BY name, labels"
+            ).fetchall()
+
+        # Buckets have to be listed in increasing order of their bound
+        rows.sort(key=lambda row: (row[0], ) + bucket_order(row[1]))
+
+        lines = []
+        declared = set()
+
+        for name, labels, value in rows:
+            family, kind = name, "counter"
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and name[:-len(suffix)] in HISTOGRAMS:
+                    family, kind = name[:-len(suffix)], "histogram"
+
+            if family not in declared:
+                lines.append(f"# TYPE {family} {kind}")
+                declared.add(family)
+
+            lines.append(f"{name}{{{labels}}} {value:g}" if labels else f"{name} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+def retire_finished(connection, seen_before):
+    """Fold counters of workers not seen since seen_before into "finished" rows and drop theirs."""
+    finished = ("worker != 'finished' AND worker NOT IN "
+                "(SELECT worker FROM metrics_workers WHERE seen >= ?)")
+
+    connection.execute(
+        "INSERT INTO metrics (worker, name, labels, value) "
+        f"SELECT 'finished', name, labels, SUM(value) FROM metrics WHERE {finished} GROUP BY name, labels "
+        "ON CONFLICT (worker, name, labels) DO UPDATE SET value = value + excluded.value",
+        (seen_before, ))
+    connection.execute(f"DELETE FROM metrics WHERE {finished}", (seen_before, ))
+    connection.execute("DELETE FROM metrics_workers WHERE seen < ?",
+                       (seen_before, ))
+
+
+def format_labels(labels):
+    """Render labels as Prometheus label list, e.g. route="/",status="200"."""
+    # Bucket bound goes last, so buckets of one series sort together
+    return ",".join(
+        f'{key}="{escape_label(value)}"'
+        for key, value in sorted(labels.items(), key=lambda item: (item[0] == "le", item[0])))
+
+
+def bucket_order(labels):
+    """Split labels into series labels and numeric bucket bound for sorting."""
+    series, _, bound = labels.partition('le="')
+    return (series, float(bound.rstrip('"')) if bound else 0)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+metrics = Metrics(METRICS_PATH, METRICS_FLUSH_INTERVAL, METRICS_RETIRE_AFTER)
+
+# Timings of one request may be updated from several lookup threads
+timings_lock = threading.Lock()
+
+
+def record_timing(kind, seconds):
+    """Add time spent in SQL, HTTP or template to current request, if any."""
+    timings = current_timings.get()
+    if timings is not None:
+        with timings_lock:
+            timings[kind] = timings.get(kind, 0) + seconds
+            timings[f"{kind}_count"] = timings.get(f"{kind}_count", 0) + 1
+
+
+def carry_timings(function):
+    """Wrap function so time it spends in another thread is counted to current request."""
+    timings = current_timings.get()
+
+    @wraps(function)
+    def decorated_function(*args):
+        token = current_timings.set(timings)
+        try:
+            return function(*args)
+        finally:
+            current_timings.reset(token)
+
+    return decorated_function
+
+
+def record_upstream(host, status, seconds):
+    """Count outbound HTTP request and its duration."""
+    metrics.inc("upstream_requests_total", host=host, status=status)
+    metrics.inc("upstream_request_seconds_total", seconds, host=host)
+    record_timing("http", seconds)
+
+
+def instrument(app, engine):
+    """Time requests, SQL and templates of app and add Server-Timing header."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context,
+                             executemany):
+        seconds = time.perf_counter() - conn.info["query_started"].pop()
+        metrics.inc("sql_queries_total")
+        metrics.inc("sql_seconds_total", seconds)
+        record_timing("sql", seconds)
+
+    # Templates render in the request thread, one at a time
+    def before_render(sender, template, context, **extra):
+        timings = current_timings.get()
+        if timings is not None:
+            timings["template_started"] = time.perf_counter()
+
+    def rendered(sender, template, context, **extra):
+        timings = current_timings.get()
+        if timings is not None and "template_started" in timings:
+            seconds = time.perf_counter() - timings.pop("template_started")
+            metrics.inc("template_seconds_total", seconds, template=template.name)
+            record_timing("template", seconds)
+
+    before_render_template.connect(before_render, app, weak=False)
+    template_rendered.connect(rendered, app, weak=False)
+
+    @app.before_request
+    def start_timer():
+        current_timings.set({"started": time.perf_counter()})
+
+    # Threads serve many requests, timings must not leak into the next one
+    @app.teardown_request
+    def clear_timer(error):
+        current_timings.set(None)
+
+    @app.after_request
+    def stop_timer(response):
+        timings = current_timings.get()
+        if timings is None:
+            return response
+
+        seconds = time.perf_counter() - timings["started"]
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+
+        metrics.inc("http_requests_total", route=route, method=request.method,
+                    status=response.status_code)
+        metrics.observe("http_request_duration_seconds", seconds, route=route)
+        for kind in ("sql", "http", "template"):
+            if kind in timings:
+                metrics.inc(f"http_request_{kind}_seconds_total", timings[kind],
+                            route=route)
+
+        # HTTP time is summed over concurrent lookups, so it may exceed total
+        response.headers["Server-Timing"] = ", ".join(
+            [f"total;dur={seconds * 1000:.1f}"] +
+            [f'{kind};dur={timings[kind] * 1000:.1f};desc="{timings[kind + "_count"]}x"'
+             for kind in ("sql", "http", "template") if kind in timings])
+
+        return response
@@ -0,0 +1,133 @@
+import fcntl
+
+from sqlalchemy import text
+
+# Schema version is stored in SQLite user_version pragma of the database file
+
+
+def create_tables(connection):
+    """Create initial tables."""
+    commands = [
+        "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, username TEXT NOT NULL, hash TEXT NOT NULL, cash NUMERIC NOT NULL DEFAULT 10000.00);",
+        "CREATE UNIQUE INDEX IF NOT EXISTS username ON users (username);",
+        "CREATE TABLE IF NOT EXISTS transactions(user_id INTEGER, orderid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, name TEXT NOT NULL, symbol TEXT NOT NULL, type TEXT NOT NULL, price NUMERIC NOT NULL, shares INTEGER NOT NULL, date TEXT NOT NULL, FOREIGN KEY (user_id) REFERENCES users(id));",
+        "CREATE TABLE IF NOT EXISTS wallet(user_id INTEGER, name TEXT NOT NULL, symbol TEXT NOT NULL, shares INTEGER NOT NULL, FOREIGN KEY (user_id) REFERENCES users(id));"
+    ]
+
+    for command in commands:
+        connection.execute(text(command))
+
+
+def add_wallet_cost_basis(connection):
+    """Add running cost basis to wallet and backfill it from transactions."""
+
+    wallet_columns = [
+        column["name"] for column in connection.execute(
+            text("PRAGMA table_info(wallet)")).mappings()
+    ]
+
+    # Databases created before migrations existed may have the columns already
+    if "bought_cost" in wallet_columns and "bought_shares" in wallet_columns:
+        return
+
+    commands = []
+    if "bought_cost" not in wallet_columns:
+        commands.append("ALTER TABLE wallet ADD COLUMN bought_cost NUMERIC NOT NULL DEFAULT 0;")
+    if "bought_shares" not in wallet_columns:
+        commands.append("ALTER TABLE wallet ADD COLUMN bought_shares INTEGER NOT NULL DEFAULT 0;")
+
+    commands += [
+        "UPDATE wallet SET bought_cost = (SELECT COALESCE(SUM(price * shares), 0) FROM transactions WHERE transactions.user_id = wallet.user_id AND transactions.symbol = wallet.symbol AND transactions.type = 'buy'), bought_shares = (SELECT COALESCE(SUM(shares), 0) FROM transactions WHERE transactions.user_id = wallet.user_id AND transactions.symbol = wallet.symbol AND transactions.type = 'buy');"
+    ]
+
+    for command in commands:
+        connection.execute(text(command))
+
+
+def add_indexes(connection):
+    """Make (user_id, symbol) unique in wallet and index transactions by user."""
+    commands = [
+        # Merge duplicated wallet rows, which would break the unique index
+        "UPDATE wallet SET shares = (SELECT SUM(shares) FROM wallet AS duplicate WHERE duplicate.user_id = wallet.user_id AND duplicate.symbol = wallet.symbol) WHERE rowid IN (SELECT MIN(rowid) FROM wallet GROUP BY user_id, symbol HAVING COUNT(*) > 1);",
+        "DELETE FROM wallet WHERE rowid NOT IN (SELECT MIN(rowid) FROM wallet GROUP BY user_id, symbol);",
+        "CREATE UNIQUE INDEX IF NOT EXISTS wallet_user_symbol ON wallet (user_id, symbol);",
+        "CREATE INDEX IF NOT EXISTS transactions_user_date ON transactions (user_id, date);",
+        "CREATE INDEX IF NOT EXISTS transactions_user_symbol_type ON transactions (user_id, symbol, type);"
+    ]
+
+    for command in commands:
+        connection.execute(text(command))
+
+
+def add_history_index(connection):
+    """Index transactions by user and orderid for keyset pagination of history."""
+    connection.execute(
+        text(
+            "CREATE INDEX IF NOT EXISTS transactions_user_orderid ON transactions (user_id, orderid);"
+        ))
+
+
+def add_sessions(connection):
+    """Create table of server-side sessions."""
+    commands = [
+        "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY NOT NULL, data TEXT NOT NULL, expires REAL NOT NULL);",
+        "CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);"
+    ]
+
+    for command in commands:
+        connection.execute(text(command))
+
+
+def add_cash_deposits(connection):
+    """Record cash deposits, so account value can be replayed from the ledger."""
+    commands = [
+        "CREATE TABLE IF NOT EXISTS cash_deposits (id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, user_id INTEGER NOT NULL, amount NUMERIC NOT NULL, date TEXT NOT NULL, FOREIGN KEY (user_id) REFERENCES users(id));",
+        "CREATE INDEX IF NOT EXISTS cash_deposits_user_id ON cash_deposits (user_id, id);"
+    ]
+
+    for command in commands:
+        connection.execute(text(command))
+
+
+# Ordered list of schema versions, each upgrade has to be safe to run on partially migrated database
+MIGRATIONS = [
+    (1, create_tables),
+    (2, add_wallet_cost_basis),
+    (3, add_indexes),
+    (4, add_history_index),
+    (5, add_sessions),
+    (6, add_cash_deposits),
+]
+
+
+def schema_version(connection):
+    """Return current schema version of database."""
+    return connection.execute(text("PRAGMA user_version")).scalar()
+
+
+def migrate(engine, target=None):
+    """Upgrade database schema to target version (latest by default)."""
+
+    # Workers start at the same time, only one of them may run migrations
+    with open(f"{engine.url.database}.migrate.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        with engine.begin() as connection:
+            version = schema_version(connection)
+
+        for migration_version, upgrade in MIGRATIONS:
+            if migration_version <= version:
+                continue
+            if target is not None and migration_version > target:
+                break
+
+            # Every upgrade and its version bump are committed together; pysqlite
+            # runs DDL outside of its implicit transactions, so one is begun explicitly
+            with engine.begin() as connection:
+                connection.exec_driver_sql("BEGIN IMMEDIATE")
+                print(
+                    f"Migrating database to version {migration_version}: {upgrade.__doc__}"
+                )
+                upgrade(connection)
+                connection.execute(
+                    text(f"PRAGMA user_version = {migration_version}"))
@@ -0,0 +1,229 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+
+class OrderError(Exception):
+    """Order was rejected; message and code are shown to user as apology."""
+
+    def __init__(self, message, code=400):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+class LegError(OrderError):
+    """One leg of a basket was rejected, so none of its legs were executed."""
+
+    def __init__(self, leg, error):
+        super().__init__(error.message, error.code)
+        self.leg = leg
+
+
+def begin_immediate(db_session):
+    """Start write transaction, so concurrent workers wait for each other instead of racing."""
+    db_session.connection().exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def execute_buy(db_session, user_id, stock, shares):
+    """Buy shares of stock at its price in a single transaction."""
+
+    try:
+        begin_immediate(db_session)
+        buy_shares(db_session, user_id, stock, shares)
+        db_session.commit()
+
+    except BaseException:
+        db_session.rollback()
+        raise
+
+
+def buy_shares(db_session, user_id, stock, shares):
+    """Take cash and add shares of stock inside the current transaction."""
+
+    total_price = stock["price"] * shares
+
+    # Take cash only if user has enough of it
+    result = db_session.execute(
+        text(
+            "UPDATE users SET cash = cash - :total_price WHERE id = :user_id AND cash >= :total_price"
+        ), {
+            "total_price": total_price,
+            "user_id": user_id
+        })
+
+    if result.rowcount != 1:
+        raise OrderError("You need to provide more cash.", 403)
+
+    # Add transaction
+    db_session.execute(
+        text(
+            "INSERT INTO transactions (user_id, name, symbol, type, price, shares, date) VALUES (:user_id, :name, :symbol, :type, :price, :shares, :date)"
+        ), {
+            "user_id": user_id,
+            "name": stock["name"],
+            "symbol": stock["symbol"],
+            "type": "buy",
+            "price": stock["price"],
+            "shares": shares,
+            "date": datetime.now()
+        })
+
+    # Insert new entry to wallet or add shares to existing one
+    db_session.execute(
+        text(
+            "INSERT INTO wallet (user_id, name, symbol, shares, bought_cost, bought_shares) VALUES (:user_id, :name, :symbol, :shares, :total_price, :shares) "
+            "ON CONFLICT (user_id, symbol) DO UPDATE SET shares = shares + excluded.shares, bought_cost = bought_cost + excluded.bought_cost, bought_shares = bought_shares + excluded.bought_shares"
+        ), {
+            "user_id": user_id,
+            "name": stock["name"],
+            "symbol": stock["symbol"],
+            "shares": shares,
+            "total_price": total_price
+        })
+
+
+def execute_sell(db_session, user_id, symbol, price, shares):
+    """Sell shares of symbol at price in a single transaction."""
+
+    try:
+        begin_immediate(db_session)
+        sell_shares(db_session, user_id, symbol, price, shares)
+        db_session.commit()
+
+    except BaseException:
+        db_session.rollback()
+        raise
+
+
+def sell_shares(db_session, user_id, symbol, price, shares):
+    """Take shares of symbol and add cash inside the current transaction."""
+
+    total_price = price * shares
+
+    # Take shares only if user owns enough of them
+    result = db_session.execute(
+        text(
+            "UPDATE wallet SET shares = shares - :shares WHERE user_id = :user_id AND symbol = :symbol AND shares >= :shares"
+        ), {
+            "shares": shares,
+            "user_id": user_id,
+            "symbol": symbol
+        })
+
+    if result.rowcount != 1:
+        raise OrderError("You don't own that many stock.", 400)
+
+    wallet = db_session.execute(
+        text(
+            "SELECT name, symbol, shares FROM wallet WHERE user_id = :user_id AND symbol = :symbol"
+        ), {
+            "user_id": user_id,
+            "symbol": symbol
+        }).mappings().one()
+
+    # Add transaction
+    db_session.execute(
+        text(
+            "INSERT INTO transactions (user_id, name, symbol, type, price, shares, date) VALUES (:user_id, :name, :symbol, :type, :price, :shares, :date)"
+        ), {
+            "user_id": user_id,
+            "name": wallet["name"],
+            "symbol": wallet["symbol"],
+            "type": "sell",
+            "price": price,
+            "shares": shares,
+            "date": datetime.now()
+        })
+
+    # Update the user's cash value
+    db_session.execute(
+        text(
+            "UPDATE users SET cash = cash + :total_price WHERE id = :user_id"
+        ), {
+            "total_price": total_price,
+            "user_id": user_id
+        })
+
+    # If shares are zero, delete the stock from the wallet
+    if wallet["shares"] == 0:
+        db_session.execute(
+            text(
+                "DELETE FROM wallet WHERE user_id = :user_id AND symbol = :symbol"
+            ), {
+                "user_id": user_id,
+                "symbol": symbol
+            })
+
+
+def execute_deposit(db_session, user_id, amount):
+    """Add cash to account and record the deposit in a single transaction."""
+
+    try:
+        begin_immediate(db_session)
+
+        db_session.execute(
+            text("UPDATE users SET cash = cash + :amount WHERE id = :user_id"),
+            {
+                "amount": amount,
+                "user_id": user_id
+            })
+
+        db_session.execute(
+            text(
+                "INSERT INTO cash_deposits (user_id, amount, date) VALUES (:user_id, :amount, :date)"
+            ), {
+                "user_id": user_id,
+                "amount": amount,
+                "date": datetime.now()
+            })
+
+        db_session.commit()
+
+    except BaseException:
+        db_session.rollback()
+        raise
+
+
+def execute_basket(db_session, user_id, legs):
+    """Execute buy and sell legs all or nothing in a single transaction.
+
+    Each leg is a dictionary with type ("buy" or "sell"), stock and shares.
+    Sells run first, so their proceeds can pay for buys of the same basket.
+    """
+
+    buys = sum(leg["stock"]["price"] * leg["shares"] for leg in legs
+               if leg["type"] == "buy")
+    sells = sum(leg["stock"]["price"] * leg["shares"] for leg in legs
+                if leg["type"] == "sell")
+
+    try:
+        begin_immediate(db_session)
+
+        # Check combined cash requirement once, instead of failing on one of the last buys
+        cash = db_session.execute(
+            text("SELECT cash FROM users WHERE id = :user_id"),
+            {"user_id": user_id}).scalar()
+
+        if cash + sells < buys:
+            raise OrderError("You need to provide more cash.", 403)
+
+        order = sorted(range(len(legs)), key=lambda index: legs[index]["type"] != "sell")
+
+        for index in order:
+            leg = legs[index]
+
+            try:
+                if leg["type"] == "sell":
+                    sell_shares(db_session, user_id, leg["stock"]["symbol"],
+                                leg["stock"]["price"], leg["shares"])
+                else:
+                    buy_shares(db_session, user_id, leg["stock"], leg["shares"])
+            except OrderError as error:
+                raise LegError(index, error)
+
+        db_session.commit()
+
+    except BaseException:
+        db_session.rollback()
+        raise
@@ -0,0 +1,207 @@
+import fcntl
+import os
+import re
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# Every price is one fixed-size record, so a file can be memory-mapped as an array
+RECORD = np.dtype([("time", "<f8"), ("price", "<f8")])
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Trading days per year, for annualized volatility
+TRADING_DAYS = 252
+
+
+class PriceHistory:
+    """Append-only price history, one file of (time, price) records per symbol."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, symbol):
+        """Return file of symbol; characters not allowed in file names are replaced."""
+        return os.path.join(self.directory,
+                            re.sub(r"[^A-Z0-9.\-]", "_", symbol.upper()) + ".bin")
+
+    def append(self, symbol, price, when=None):
+        """Append price of symbol observed at when (epoch seconds, now by default)."""
+        record = np.array([(time.time() if when is None else when, price)],
+                          dtype=RECORD)
+
+        path = self.path(symbol)
+
+        # Compaction must not replace the file between open and write
+        with locked(path):
+            with open(path, "ab") as file:
+                file.write(record.tobytes())
+
+    def series(self, symbol):
+        """Return all records of symbol as memory-mapped array ordered by time of append."""
+        return read_records(self.path(symbol))
+
+    def daily_closes(self, symbol):
+        """Return days (days since epoch, UTC) and last price recorded on each of them."""
+        records = self.series(symbol)
+
+        if len(records) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        days = (records["time"] // SECONDS_PER_DAY).astype(np.int64)
+        prices = np.asarray(records["price"])
+
+        # Records are appended in time order, so last record of a day is where the next day starts
+        if np.all(days[1:] >= days[:-1]):
+            last = np.append(np.flatnonzero(days[1:] != days[:-1]), len(days) - 1)
+            return days[last], prices[last]
+
+        # Backfilled records are out of order; last of each day is the first one of reversed array
+        unique_days, reversed_index = np.unique(days[::-1], return_index=True)
+        return unique_days, prices[len(days) - 1 - reversed_index]
+
+    def compact(self, today=None):
+        """Keep only the last record of every day before today in all files.
+
+        Returns number of removed records. Run daily by the price refresher,
+        so files don't grow with every fetched price forever.
+        """
+        if today is None:
+            today = int(time.time() // SECONDS_PER_DAY)
+
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".bin"):
+                removed += compact_file(entry.path, today)
+
+        return removed
+
+    def close_matrix(self, symbols, grid):
+        """Return closes of symbols on grid of days, carrying last known close forward.
+
+        Rows follow symbols, columns follow grid; NaN before the first known close.
+        """
+        closes = np.full((len(symbols), len(grid)), np.nan)
+
+        for row, symbol in enumerate(symbols):
+            days, prices = self.daily_closes(symbol)
+            if len(days) == 0:
+                continue
+
+            # Index of the last close on or before every day of the grid
+            index = np.searchsorted(days, grid, side="right") - 1
+            known = index >= 0
+            closes[row, known] = prices[index[known]]
+
+        return closes
+
+
+def read_records(path):
+    """Return records of file as memory-mapped array, empty if there is no file."""
+    try:
+        count = os.path.getsize(path) // RECORD.itemsize
+    except OSError:
+        count = 0
+
+    if count == 0:
+        return np.empty(0, dtype=RECORD)
+
+    return np.memmap(path, dtype=RECORD, mode="r", shape=(count, ))
+
+
+@contextmanager
+def locked(path):
+    """Hold exclusive lock of file across workers, like migrate does for the database."""
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def compact_file(path, today):
+    """Rewrite file with last record of every past day and all records from today on.
+
+    Returns number of removed records.
+    """
+    # Appends wait until the compacted file is in place
+    with locked(path):
+        records = np.array(read_records(path))
+        days = (records["time"] // SECONDS_PER_DAY).astype(np.int64)
+
+        # Same record daily_closes picks: last appended of every day, in order of append
+        _, reversed_index = np.unique(days[::-1], return_index=True)
+        keep = days >= today
+        keep[len(days) - 1 - reversed_index] = True
+        kept = records[keep]
+
+        if len(kept) == len(records):
+            return 0
+
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(kept.tobytes())
+
+        os.replace(temp_path, path)
+
+    return len(records) - len(kept)
+
+
+def day_grid(days, today=None):
+    """Return last days days up to today as days since epoch."""
+    if today is None:
+        today = int(time.time() // SECONDS_PER_DAY)
+    return np.arange(today - days + 1, today + 1, dtype=np.int64)
+
+
+def portfolio_analytics(history, positions, days, today=None):
+    """Compute value series, returns, volatility, drawdown and P&L of positions over last days.
+
+    Positions are dictionaries with symbol, shares and invested. Series are
+    valued with current shares of each position.
+    """
+
+    grid = day_grid(days, today)
+    symbols = [position["symbol"] for position in positions]
+    shares = np.array([position["shares"] for position in positions], dtype=float)
+    invested = np.array([position["invested"] for position in positions], dtype=float)
+
+    closes = history.close_matrix(symbols, grid)
+
+    # Days before first known price of a position contribute nothing
+    values = np.nan_to_num(closes) * shares[:, None]
+    value = values.sum(axis=0)
+
+    # Return of every day is taken only over positions priced on both days,
+    # so a position whose history starts inside the window is not a price move
+    priced = ~np.isnan(closes[:, :-1]) & ~np.isnan(closes[:, 1:])
+    previous = (np.where(priced, closes[:, :-1], 0) * shares[:, None]).sum(axis=0)
+    current = (np.where(priced, closes[:, 1:], 0) * shares[:, None]).sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = np.where(previous > 0, current / previous - 1, np.nan)
+    valid_returns = returns[~np.isnan(returns)]
+
+    volatility = (float(np.std(valid_returns, ddof=1) * np.sqrt(TRADING_DAYS))
+                  if len(valid_returns) > 1 else None)
+
+    # Drawdown of the chained returns, days without a return change nothing
+    growth = np.concatenate([[1.0], np.cumprod(1 + np.nan_to_num(returns))])
+    drawdown = growth / np.maximum.accumulate(growth) - 1
+
+    last_close = closes[:, -1] if len(grid) else np.full(len(symbols), np.nan)
+    profit = shares * last_close - invested
+
+    return {
+        "dates": grid.astype("datetime64[D]").astype(str).tolist(),
+        "value": value.tolist(),
+        "returns": [None if np.isnan(r) else float(r) for r in returns],
+        "volatility": volatility,
+        "max_drawdown": float(drawdown.min()),
+        "positions": [{
+            "symbol": symbol,
+            "shares": int(shares[row]),
+            "last_close": None if np.isnan(last_close[row]) else float(last_close[row]),
+            "invested": float(invested[row]),
+            "profit": None if np.isnan(profit[row]) else float(profit[row])
+        } for row, symbol in enumerate(symbols)]
+    }
@@ -0,0 +1,157 @@
+import sqlite3
+import threading
+import time
+
+from cache import ConnectionPool
+
+
+class TokenBucket:
+    """Token bucket stored in SQLite file, so its rate is shared by all workers on the host."""
+
+    def __init__(self, path, name, rate, capacity):
+        self.path = path
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.throttled = 0
+        self.rejected = 0
+        # Autocommit mode, transactions are started explicitly
+        self._pool = ConnectionPool(path, isolation_level=None)
+        self._lock = threading.Lock()
+
+        with self._pool.connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits (name TEXT PRIMARY KEY NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL, blocked_until REAL NOT NULL)"
+            )
+            connection.execute(
+                "INSERT OR IGNORE INTO rate_limits (name, tokens, updated, blocked_until) VALUES (?, ?, ?, 0)",
+                (self.name, self.capacity, time.time()))
+
+    def _take(self):
+        """Take one token; return 0 on success or number of seconds to wait."""
+        with self._pool.connection() as connection:
+            return self._take_locked(connection)
+
+    def _take_locked(self, connection):
+        # Lock the bucket for writing, so workers don't take the same token
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, updated, blocked_until = connection.execute(
+                "SELECT tokens, updated, blocked_until FROM rate_limits WHERE name = ?",
+                (self.name, )).fetchone()
+
+            now = time.time()
+
+            if blocked_until > now:
+                wait = blocked_until - now
+            else:
+                tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0
+                else:
+                    wait = (1 - tokens) / self.rate
+
+                connection.execute(
+                    "UPDATE rate_limits SET tokens = ?, updated = ? WHERE name = ?",
+                    (tokens, now, self.name))
+
+            connection.execute("COMMIT")
+
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        return wait
+
+    def acquire(self, max_wait):
+        """Wait for a token, but no longer than max_wait seconds; return True if acquired."""
+        deadline = time.monotonic() + max_wait
+        throttled = False
+
+        while True:
+            try:
+                wait = self._take()
+            except sqlite3.Error:
+                # Rate limiting is best effort, don't block calls when the store fails
+                return True
+
+            if wait == 0:
+                return True
+
+            if time.monotonic() + wait > deadline:
+                with self._lock:
+                    self.rejected += 1
+                return False
+
+            if not throttled:
+                throttled = True
+                with self._lock:
+                    self.throttled += 1
+
+            time.sleep(wait)
+
+    def block(self, seconds):
+        """Stop handing out tokens for given number of seconds, e.g. after HTTP 429."""
+        try:
+            with self._pool.connection() as connection:
+                connection.execute(
+                    "UPDATE rate_limits SET tokens = 0, updated = ?, blocked_until = MAX(blocked_until, ?) WHERE name = ?",
+                    (time.time(), time.time() + seconds, self.name))
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        """Return number of throttled and rejected calls of this worker."""
+        with self._lock:
+            return {"throttled": self.throttled, "rejected": self.rejected}
+
+
+class CircuitBreaker:
+    """Stop calling unhealthy upstream after repeated failures, try again after a while."""
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+        self._open_until = 0
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """Return True if calls are currently not allowed."""
+        return time.monotonic() < self._open_until
+
+    def allow(self):
+        """Return True if call may be made now."""
+        with self._lock:
+            if self.is_open():
+                self.rejected += 1
+                return False
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._open_until = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+            # After reset timeout single failure opens the circuit again
+            if self.failures >= self.failure_threshold and not self.is_open():
+                self._open_until = time.monotonic() + self.reset_timeout
+                self.trips += 1
+
+    def stats(self):
+        """Return state and counters of circuit breaker."""
+        with self._lock:
+            return {
+                "open": self.is_open(),
+                "failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected
+            }
@@ -0,0 +1,116 @@
+"""Keep prices of all symbols held in any wallet warm in the shared quote cache.
+
+Also downloads the US symbol list into the local file used by search and
+compacts price history once a day; those run even when PRICE_REFRESHER is off.
+
+Started by gunicorn.conf.py beside the workers, can also be run on its own:
+
+    python refresher.py
+"""
+
+import os
+import sqlite3
+import time
+
+from finnhub import FINNHUB_CALLS_PER_MINUTE
+from helpers import PRICE_CACHE_TTL, QUOTE_CACHE_BACKEND, price_history, refresh_prices
+from pricehistory import SECONDS_PER_DAY
+from symbols import refresh_symbols
+
+DATABASE_PATH = os.environ.get(
+    "DATABASE_PATH",
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), "finance.db"))
+
+# "off" keeps only symbol list and price history maintenance
+PRICE_REFRESHER = os.environ.get("PRICE_REFRESHER", "on")
+
+# How often prices are refreshed and how many symbols are fetched at once
+PRICE_REFRESH_INTERVAL = float(os.environ.get("PRICE_REFRESH_INTERVAL", 30))
+PRICE_REFRESH_BATCH_SIZE = int(os.environ.get("PRICE_REFRESH_BATCH_SIZE", 20))
+
+# Refreshed price has to stay in cache until the next refresh
+PRICE_REFRESH_TTL = PRICE_REFRESH_INTERVAL + PRICE_CACHE_TTL
+
+# Share of the Finnhub rate shared by the host used by refresher, the rest is left for user requests
+PRICE_REFRESH_SHARE = float(os.environ.get("PRICE_REFRESH_SHARE", 0.5))
+PRICE_REFRESH_BUDGET = max(
+    1,
+    int(FINNHUB_CALLS_PER_MINUTE * PRICE_REFRESH_SHARE *
+        PRICE_REFRESH_INTERVAL / 60))
+
+
+def held_symbols():
+    """Return all symbols held in any wallet."""
+
+    try:
+        with sqlite3.connect(DATABASE_PATH) as connection:
+            rows = connection.execute(
+                "SELECT DISTINCT symbol FROM wallet").fetchall()
+    except sqlite3.Error:
+        # Database is not created yet
+        return []
+
+    return [row[0] for row in rows]
+
+
+def refresh_once(refreshed_at):
+    """Refresh prices of held symbols in batches, at most PRICE_REFRESH_BUDGET of them.
+
+    Symbols refreshed longest ago go first, so all of them get their turn
+    when there are more symbols than the budget allows.
+    """
+
+    symbols = sorted(held_symbols(),
+                     key=lambda symbol: refreshed_at.get(symbol, 0))
+    chosen = symbols[:PRICE_REFRESH_BUDGET]
+    refreshed = 0
+
+    for start in range(0, len(chosen), PRICE_REFRESH_BATCH_SIZE):
+        refreshed += refresh_prices(
+            chosen[start:start + PRICE_REFRESH_BATCH_SIZE], PRICE_REFRESH_TTL)
+
+    now = time.monotonic()
+    for symbol in chosen:
+        refreshed_at[symbol] = now
+
+    # Forget symbols nobody holds anymore
+    for symbol in set(refreshed_at) - set(symbols):
+        del refreshed_at[symbol]
+
+    print(f"Refreshed {refreshed} of {len(symbols)} prices.", flush=True)
+
+
+def main():
+    # Warm prices wouldn't be visible to workers without shared cache; symbols are refreshed anyway
+    refresh_prices_enabled = PRICE_REFRESHER == "on" and QUOTE_CACHE_BACKEND == "sqlite"
+    if PRICE_REFRESHER == "on" and not refresh_prices_enabled:
+        print("Prices are not refreshed without sqlite quote cache backend.", flush=True)
+
+    next_symbols_check = 0
+    compacted_day = None
+    refreshed_at = {}
+
+    while True:
+        started = time.monotonic()
+
+        if time.time() >= next_symbols_check:
+            next_symbols_check = refresh_symbols()
+
+        # Past days need only their close
+        today = int(time.time() // SECONDS_PER_DAY)
+        if today != compacted_day:
+            try:
+                removed = price_history.compact(today)
+                print(f"Compacted price history, removed {removed} records.", flush=True)
+            except OSError as error:
+                print(f"Compacting price history failed: {error}", flush=True)
+            compacted_day = today
+
+        if refresh_prices_enabled:
+            refresh_once(refreshed_at)
+
+        time.sleep(max(0, PRICE_REFRESH_INTERVAL - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    main()
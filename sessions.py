@@ -0,0 +1,130 @@
+import secrets
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy import text
+from werkzeug.datastructures import CallbackDict
+
+
+def new_session_id():
+    """Return random session id."""
+    return secrets.token_urlsafe(32)
+
+
+class SQLiteSession(CallbackDict, SessionMixin):
+    """Session data stored in sessions table under random id kept in cookie."""
+
+    def __init__(self, initial=None, sid=None, new=False, expires=0):
+
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires = expires
+        self.modified = False
+        self.old_sid = None
+
+    def clear(self):
+        """Clear session and give it a new id, so id known before login can't be reused."""
+        if not self.new and self.old_sid is None:
+            self.old_sid = self.sid
+        self.sid = new_session_id()
+        super().clear()
+
+
+class SQLiteSessionInterface(SessionInterface):
+    """Keep sessions in a table of the application database.
+
+    Session is written only when it changes or gets close to expiry, and
+    expired sessions are deleted in batches at most once per sweep interval.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, engine, lifetime, sweep_interval=60, sweep_batch=500):
+        self.engine = engine
+        self.lifetime = lifetime
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self._next_sweep = 0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+
+        if sid:
+            with self.engine.connect() as connection:
+                row = connection.execute(
+                    text(
+                        "SELECT data, expires FROM sessions WHERE id = :id AND expires > :now"
+                    ), {
+                        "id": sid,
+                        "now": time.time()
+                    }).first()
+
+            if row is not None:
+                return SQLiteSession(self.serializer.loads(row.data),
+                                     sid=sid,
+                                     expires=row.expires)
+
+        return SQLiteSession(sid=new_session_id(), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # Session was cleared, e.g. on login or logout: remove its old id
+        if session.old_sid is not None:
+            with self.engine.begin() as connection:
+                connection.execute(text("DELETE FROM sessions WHERE id = :id"),
+                                   {"id": session.old_sid})
+
+        # Empty session is not stored, cookie is removed from browser
+        if not session:
+            if session.modified and not session.new:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+
+        # Unchanged session is written again only to extend its expiry
+        if session.modified or session.expires - now < self.lifetime / 2:
+            with self.engine.begin() as connection:
+                connection.execute(
+                    text(
+                        "INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (:id, :data, :expires)"
+                    ), {
+                        "id": session.sid,
+                        "data": self.serializer.dumps(dict(session)),
+                        "expires": now + self.lifetime
+                    })
+
+            response.set_cookie(name,
+                                session.sid,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain,
+                                path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+
+        self.sweep(now)
+
+    def sweep(self, now):
+        """Delete a batch of expired sessions, at most once per sweep interval."""
+
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE expires <= :now LIMIT :batch)"
+                ), {
+                    "now": now,
+                    "batch": self.sweep_batch
+                })
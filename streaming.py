@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+
+
+class PriceFeed:
+    """Poll prices of symbols watched by clients of this worker and fan changes out to them.
+
+    Prices are read through the quote cache, which the price refresher keeps
+    warm for all held symbols, so connected clients don't add upstream calls.
+    """
+
+    def __init__(self, fetch_prices, interval):
+        self.fetch_prices = fetch_prices
+        self.interval = interval
+        self._prices = {}
+        self._subscriptions = set()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, symbols):
+        """Start receiving changed prices of symbols; known prices are sent right away."""
+        subscription = Subscription(symbols)
+
+        with self._lock:
+            self._subscriptions.add(subscription)
+
+            known = {
+                symbol: self._prices[symbol]
+                for symbol in subscription.symbols if symbol in self._prices
+            }
+
+            # Started on first use, so the thread runs in worker and not in master
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="price-feed",
+                                                daemon=True)
+                self._thread.start()
+
+        if known:
+            subscription.queue.put(known)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+
+            try:
+                self.poll()
+            except Exception as error:
+                # Feed must survive a bad tick, clients just wait for the next one
+                print(f"Price feed failed: {error}", flush=True)
+
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def poll(self):
+        """Fetch prices of all watched symbols and push changed ones to subscribers."""
+        with self._lock:
+            symbols = set().union(*(subscription.symbols
+                                    for subscription in self._subscriptions))
+
+            # Forget symbols nobody watches, their next price is sent as a change
+            for symbol in set(self._prices) - symbols:
+                del self._prices[symbol]
+
+        if not symbols:
+            return
+
+        prices = self.fetch_prices(sorted(symbols))
+
+        with self._lock:
+            changes = {
+                symbol: price
+                for symbol, price in prices.items()
+                if self._prices.get(symbol) != price
+            }
+            self._prices.update(changes)
+            subscriptions = list(self._subscriptions)
+
+        # Every client gets only changes of symbols it holds
+        for subscription in subscriptions:
+            delta = {
+                symbol: price
+                for symbol, price in changes.items()
+                if symbol in subscription.symbols
+            }
+            if delta:
+                subscription.queue.put(delta)
+
+    def stats(self):
+        """Return number of connected clients and watched symbols."""
+        with self._lock:
+            return {
+                "subscriptions": len(self._subscriptions),
+                "symbols": len(self._prices)
+            }
+
+
+class Subscription:
+    """Changed prices waiting to be sent to one client."""
+
+    def __init__(self, symbols):
+        self.symbols = frozenset(symbols)
+        self.queue = queue.Queue()
@@ -0,0 +1,267 @@
+import fcntl
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+import requests
+
+from finnhub import finnhub_get
+
+# Local copy of US symbol list, shared by all workers on the host
+SYMBOLS_PATH = os.environ.get(
+    "SYMBOLS_PATH",
+    os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                 "us_symbols.json.gz"))
+
+# How often the price refresher downloads symbol list again and how soon it retries after failure (seconds)
+SYMBOLS_REFRESH_INTERVAL = float(
+    os.environ.get("SYMBOLS_REFRESH_INTERVAL", 24 * 60 * 60))
+SYMBOLS_RETRY_INTERVAL = float(os.environ.get("SYMBOLS_RETRY_INTERVAL", 60))
+
+# How often workers check whether the local file was replaced (seconds)
+SYMBOLS_CHECK_INTERVAL = float(os.environ.get("SYMBOLS_CHECK_INTERVAL", 10))
+
+# Maximum number of results returned by local search
+SEARCH_LIMIT = int(os.environ.get("SEARCH_LIMIT", 20))
+
+# Fields kept from API response, in order of columns in the local file
+SYMBOL_FIELDS = ["symbol", "displaySymbol", "description", "type"]
+
+
+class SymbolIndex:
+    """In-memory index of symbol universe with O(1) membership and prefix lookups."""
+
+    def __init__(self, rows, mtime=0):
+        self.mtime = mtime
+        self.entries = {
+            row[0]: dict(zip(SYMBOL_FIELDS, row))
+            for row in rows
+        }
+        self.sorted_symbols = sorted(self.entries)
+
+        # Sorted (token, symbol) pairs of company descriptions for prefix matching
+        self.sorted_tokens = sorted({(token, symbol)
+                                     for symbol, entry in self.entries.items()
+                                     for token in tokenize(entry["description"])})
+
+    def __contains__(self, symbol):
+        return symbol in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, symbol):
+        """Return entry for symbol or None."""
+        return self.entries.get(symbol)
+
+    def with_prefix(self, prefix, limit=None):
+        """Return symbols starting with prefix in alphabetical order."""
+        result = []
+        position = bisect_left(self.sorted_symbols, prefix)
+
+        while position < len(self.sorted_symbols) and self.sorted_symbols[
+                position].startswith(prefix):
+            result.append(self.sorted_symbols[position])
+            if limit is not None and len(result) >= limit:
+                break
+            position += 1
+
+        return result
+
+    def with_token_prefix(self, prefix):
+        """Return set of symbols whose description has a word starting with prefix."""
+        result = set()
+        position = bisect_left(self.sorted_tokens, (prefix, ))
+
+        while position < len(self.sorted_tokens) and self.sorted_tokens[
+                position][0].startswith(prefix):
+            result.add(self.sorted_tokens[position][1])
+            position += 1
+
+        return result
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Return best-matching entries for query.
+
+        Exact ticker goes first, then tickers starting with query, then
+        companies whose description contains words starting with every
+        word of query. Shorter tickers are ranked higher within each group.
+        """
+
+        query = query.strip().upper()
+        if not query:
+            return []
+
+        ranks = {}
+
+        for symbol in self.with_prefix(query):
+            ranks[symbol] = 0 if symbol == query else 1
+
+        # Description matches rank below tickers, skip them if tickers fill the limit
+        if len(ranks) < limit:
+
+            # Every word of query has to match some word of description
+            matches = None
+            for token in tokenize(query):
+                symbols = self.with_token_prefix(token)
+                matches = symbols if matches is None else matches & symbols
+
+            for symbol in matches or ():
+                ranks.setdefault(symbol, 2)
+
+        best = sorted(ranks,
+                      key=lambda symbol: (ranks[symbol], len(symbol), symbol))
+
+        return [self.entries[symbol] for symbol in best[:limit]]
+
+
+def tokenize(text):
+    """Split text into upper case words."""
+    return re.findall(r"[A-Z0-9]+", text.upper())
+
+
+def download_symbols():
+    """Download US symbol list from API as list of rows."""
+
+    # Contact API
+    try:
+        # https://finnhub.io/docs/api/stock-symbols
+        stock_symbols_response = finnhub_get("stock/symbol", exchange="US")
+
+    except requests.RequestException:
+        return None
+
+    # Parse response
+    try:
+        return [[item.get(field) or "" for field in SYMBOL_FIELDS]
+                for item in stock_symbols_response.json()]
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def save_symbols(rows, path=SYMBOLS_PATH):
+    """Write rows to gzipped JSON file; readers see either old or new file."""
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(temp_path, "wt", encoding="utf-8") as file:
+        json.dump(rows, file, separators=(",", ":"))
+    os.replace(temp_path, path)
+
+
+def load_symbols(path=SYMBOLS_PATH):
+    """Read rows from gzipped JSON file."""
+
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def refresh_symbols():
+    """Download symbol list if the local file is missing or stale; return time of next check.
+
+    Run on a schedule by the refresher process, so workers don't wait on the
+    download. Processes of the host take turns under a file lock, so the
+    list is fetched once per host.
+    """
+
+    with open(f"{SYMBOLS_PATH}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        # File may have been downloaded by the process holding the lock before
+        try:
+            mtime = os.path.getmtime(SYMBOLS_PATH)
+        except OSError:
+            mtime = None
+
+        now = time.time()
+
+        if mtime is not None and now - mtime < SYMBOLS_REFRESH_INTERVAL:
+            return mtime + SYMBOLS_REFRESH_INTERVAL
+
+        rows = download_symbols()
+
+        # Keep stale file if there is any and try again soon
+        if not rows:
+            return now + SYMBOLS_RETRY_INTERVAL
+
+        save_symbols(rows, SYMBOLS_PATH)
+        return time.time() + SYMBOLS_REFRESH_INTERVAL
+
+
+_index = SymbolIndex([])
+_next_check = 0
+_next_download = 0
+_loading = False
+_lock = threading.Lock()
+
+
+def symbol_index(wait=True):
+    """Return index of US symbols from the local file, empty until the file exists.
+
+    The file is loaded again when its modification time changes. Without
+    wait, the reload runs in background and the index loaded so far is returned.
+    """
+    global _loading
+
+    if time.time() < _next_check:
+        return _index
+
+    if wait:
+        reload_symbols()
+        return _index
+
+    # Flag is set under the lock, so concurrent requests start only one loader
+    with _lock:
+        if _loading or time.time() < _next_check:
+            return _index
+        _loading = True
+
+    threading.Thread(target=reload_in_background,
+                     name="symbol-loader",
+                     daemon=True).start()
+    return _index
+
+
+def reload_in_background():
+    global _loading
+
+    try:
+        reload_symbols()
+    finally:
+        with _lock:
+            _loading = False
+
+
+def reload_symbols():
+    """Load local file into the index if it changed since the last check."""
+    global _index, _next_check, _next_download
+
+    # Only one thread of the worker reloads the index
+    with _lock:
+        if time.time() < _next_check:
+            return
+
+        _next_check = time.time() + SYMBOLS_CHECK_INTERVAL
+
+        try:
+            mtime = os.path.getmtime(SYMBOLS_PATH)
+        except OSError:
+            # No refresher runs, e.g. under development server; download in background
+            # and serve from API search meanwhile
+            if time.time() >= _next_download:
+                _next_download = time.time() + SYMBOLS_RETRY_INTERVAL
+                threading.Thread(target=refresh_symbols,
+                                 name="symbol-download",
+                                 daemon=True).start()
+            return
+
+        try:
+            if mtime != _index.mtime:
+                _index = SymbolIndex(load_symbols(SYMBOLS_PATH), mtime)
+
+        # File is being replaced, keep what is loaded
+        except (OSError, ValueError):
+            pass
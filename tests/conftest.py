@@ -0,0 +1,68 @@
+import importlib
+import os
+import sys
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+@pytest.fixture(scope="session")
+def upstream():
+    """Finnhub and hCaptcha stub of the benchmarks; returns its base URL."""
+    from stubs import start_stub
+
+    server, url = start_stub()
+    yield url
+    server.shutdown()
+
+
+@pytest.fixture(scope="session")
+def app_module(upstream, tmp_path_factory):
+    """Import app configured against the stub, with files in a temporary directory.
+
+    Quote caches live in memory and expire at once, so every lookup reaches
+    the stub unless it is memoized within the request.
+    """
+    directory = tmp_path_factory.mktemp("app")
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # Configuration is read on import, so environment is set up before app is imported
+        for name, value in {
+                "DATABASE_PATH": directory / "finance.db",
+                "QUOTE_CACHE_BACKEND": "memory",
+                "PROFILE_CACHE_TTL": 0,
+                "PRICE_CACHE_TTL": 0,
+                "RATE_LIMIT_PATH": directory / "quote_cache.db",
+                "METRICS_PATH": directory / "quote_cache.db",
+                "PRICE_HISTORY_PATH": directory / "price_history",
+                "SYMBOLS_PATH": directory / "us_symbols.json.gz",
+                "FINNHUB_URL": f"{upstream}/api/v1",
+                "HCAPTCHA_VERIFY_URL": f"{upstream}/siteverify",
+                "API_KEY": "test",
+                "HCAPTCHA_SITE_KEY": "test",
+                "HCAPTCHA_SECRET_KEY": "test",
+                "FINNHUB_CALLS_PER_MINUTE": 1000000,
+                "FINNHUB_BURST": 1000000
+        }.items():
+            monkeypatch.setenv(name, str(value))
+
+        yield importlib.import_module("app")
+
+
+@pytest.fixture
+def client(app_module):
+    """Test client logged in as a new user."""
+    client = app_module.app.test_client()
+    client.post("/register",
+                data={
+                    "h-captcha-response": "token",
+                    "username": f"user-{uuid.uuid4()}",
+                    "password": "password",
+                    "confirmation": "password"
+                })
+    return client
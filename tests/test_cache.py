@@ -0,0 +1,141 @@
+"""SQLite connection pool and cache shared by workers."""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+from cache import ConnectionPool, SQLiteCache
+
+
+def test_pool_opens_at_most_size_connections(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "cache.db"), size=2)
+    borrowed = []
+    release = threading.Event()
+
+    def borrow():
+        with pool.connection() as connection:
+            borrowed.append(connection)
+            release.wait()
+
+    threads = [threading.Thread(target=borrow) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+
+    # Remaining threads wait for a connection to be returned
+    while len(borrowed) < 2:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    assert len(borrowed) == 2
+
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(borrowed) == 5
+    assert len({id(connection) for connection in borrowed}) == 2
+
+    pool.close()
+    with pool.connection() as connection:
+        assert connection.execute("SELECT 1").fetchone() == (1, )
+
+
+class Clock:
+    """Stand-in for time module of cache, moved forward by tests."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def sqlite_cache(tmp_path, clock):
+    return SQLiteCache(str(tmp_path / "cache.db"), "quotes", maxsize=2, ttl=10)
+
+
+def test_entries_expire_after_ttl(sqlite_cache, clock):
+    sqlite_cache.set("A", {"price": 1})
+    sqlite_cache.set("B", {"price": 2}, ttl=30)
+
+    clock.now += 10
+    assert sqlite_cache.get("A") == {"price": 1}
+
+    clock.now += 1
+    assert sqlite_cache.get("A") is None
+    assert sqlite_cache.get("B") == {"price": 2}
+    assert sqlite_cache.stats()["hits"] == 2
+    assert sqlite_cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted(sqlite_cache, clock):
+    sqlite_cache.set("A", 1, ttl=1000)
+    clock.now += 1
+    sqlite_cache.set("B", 2, ttl=1000)
+
+    # Use of A is recorded, since it was last recorded more than touch_interval ago
+    clock.now += SQLiteCache.touch_interval
+    assert sqlite_cache.get("A") == 1
+
+    clock.now += 1
+    sqlite_cache.set("C", 3)
+
+    assert sqlite_cache.get("B") is None
+    assert sqlite_cache.get("A") == 1 and sqlite_cache.get("C") == 3
+    assert sqlite_cache.stats()["size"] == 2
+
+
+def test_use_within_touch_interval_is_not_recorded(sqlite_cache, clock):
+    sqlite_cache.set("A", 1, ttl=1000)
+    clock.now += 1
+    sqlite_cache.set("B", 2, ttl=1000)
+
+    clock.now += SQLiteCache.touch_interval - 2
+    assert sqlite_cache.get("A") == 1
+
+    # A still counts as used when it was stored, so it goes first
+    sqlite_cache.set("C", 3)
+
+    assert sqlite_cache.get("A") is None
+    assert sqlite_cache.get("B") == 2
+
+
+def test_expired_entries_are_evicted_before_used_ones(sqlite_cache, clock):
+    sqlite_cache.set("A", 1, ttl=1000)
+    sqlite_cache.set("B", 2, ttl=1)
+
+    clock.now += 2
+    sqlite_cache.set("C", 3)
+
+    assert sqlite_cache.get("A") == 1 and sqlite_cache.get("C") == 3
+
+
+def test_sqlite_cache_fails_open(sqlite_cache, tmp_path):
+    sqlite_cache.set("A", 1)
+
+    # Another process removed the table under the cache
+    with sqlite3.connect(str(tmp_path / "cache.db")) as connection:
+        connection.execute("DROP TABLE quotes")
+
+    sqlite_cache.set("A", 1)
+    assert sqlite_cache.get("A") is None
+    sqlite_cache.invalidate("A")
+    sqlite_cache.clear()
+    assert sqlite_cache.stats()["size"] is None
@@ -0,0 +1,153 @@
+"""Ledger replay into daily holdings and cash, full and incremental."""
+
+import random
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+from ledger import LedgerEngine
+from migrations import migrate
+from pricehistory import PriceHistory
+
+FIRST_DAY = date(2024, 1, 1)
+
+
+def day_number(day):
+    return (day - date(1970, 1, 1)).days
+
+
+@pytest.fixture
+def db_session(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'finance.db'}")
+    migrate(engine)
+
+    with Session(engine) as db_session:
+        db_session.execute(text("INSERT INTO users (id, username, hash) VALUES (1, 'user', 'hash')"))
+        db_session.commit()
+        yield db_session
+
+    engine.dispose()
+
+
+@pytest.fixture
+def history(tmp_path):
+    return PriceHistory(str(tmp_path / "price_history"))
+
+
+class Account:
+    """Writes random trades and deposits of user 1 in date order, keeping users.cash in step."""
+
+    def __init__(self, db_session, rng):
+        self.db_session = db_session
+        self.rng = rng
+        self.day = FIRST_DAY
+        self.shares = {}
+
+    def event(self):
+        # Several events may fall on the same day
+        self.day += timedelta(days=self.rng.choice([0, 0, 1, 3]))
+        stamp = f"{self.day} {self.rng.randrange(24):02}:00:00"
+        owned = [symbol for symbol, shares in self.shares.items() if shares > 0]
+
+        if self.rng.random() < 0.2:
+            amount = self.rng.randrange(1, 500)
+            self.db_session.execute(
+                text("INSERT INTO cash_deposits (user_id, amount, date) VALUES (1, :amount, :date)"),
+                {"amount": amount, "date": stamp})
+            self.db_session.execute(text("UPDATE users SET cash = cash + :amount WHERE id = 1"),
+                                    {"amount": amount})
+            return
+
+        if owned and self.rng.random() < 0.4:
+            kind, symbol = "sell", self.rng.choice(owned)
+            shares = self.rng.randint(1, self.shares[symbol])
+        else:
+            kind, symbol = "buy", self.rng.choice("ABCDE")
+            shares = self.rng.randint(1, 10)
+
+        price = self.rng.randrange(10, 200)
+        self.shares[symbol] = self.shares.get(symbol, 0) + (shares if kind == "buy" else -shares)
+
+        self.db_session.execute(
+            text("INSERT INTO transactions (user_id, name, symbol, type, price, shares, date) "
+                 "VALUES (1, :symbol, :symbol, :type, :price, :shares, :date)"),
+            {"symbol": symbol, "type": kind, "price": price, "shares": shares, "date": stamp})
+        self.db_session.execute(
+            text("UPDATE users SET cash = cash + :amount WHERE id = 1"),
+            {"amount": price * shares * (1 if kind == "sell" else -1)})
+
+
+def assert_same_state(incremental, full):
+    assert incremental.symbols == full.symbols
+    assert incremental.first_day == full.first_day
+    assert (incremental.last_orderid, incremental.last_deposit_id) == (full.last_orderid,
+                                                                       full.last_deposit_id)
+    np.testing.assert_allclose(incremental.holdings, full.holdings)
+    np.testing.assert_allclose(incremental.cash, full.cash)
+    np.testing.assert_array_equal(incremental.trade_prices, full.trade_prices)
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_incremental_replay_matches_full_replay(db_session, history, seed):
+    rng = random.Random(seed)
+    account = Account(db_session, rng)
+    ledger = LedgerEngine(history, maxsize=10, ttl=3600)
+
+    for _ in range(rng.randint(1, 8)):
+        for _ in range(rng.randint(0, 6)):
+            account.event()
+        db_session.commit()
+
+        # Checked on the day of the last event or a few days later, later events are not older
+        account.day += timedelta(days=rng.choice([0, 0, 2]))
+        today = day_number(account.day)
+        incremental = ledger.state(db_session, 1, today)
+        full = LedgerEngine(history, maxsize=10, ttl=3600).state(db_session, 1, today)
+
+        assert_same_state(incremental, full)
+        assert incremental.cash[-1] == pytest.approx(
+            db_session.execute(text("SELECT cash FROM users WHERE id = 1")).scalar())
+
+
+def test_new_events_are_replayed_from_cached_state(db_session, history):
+    ledger = LedgerEngine(history, maxsize=10, ttl=3600)
+    account = Account(db_session, random.Random(0))
+    today = day_number(FIRST_DAY) + 10
+
+    # Nothing is cached for a ledger without events, it would start on the wrong day
+    ledger.state(db_session, 1, today)
+    account.event()
+    db_session.commit()
+    ledger.state(db_session, 1, today)
+
+    account.event()
+    db_session.commit()
+    ledger.state(db_session, 1, today)
+    ledger.state(db_session, 1, today + 1)
+
+    assert (ledger.full_replays, ledger.tail_replays) == (2, 1)
+
+
+def test_ledger_holdings_cash_and_prices_by_day(db_session, history):
+    for symbol, kind, price, shares, stamp in [
+        ("A", "buy", 100, 10, "2024-01-01 10:00:00"),
+        ("A", "buy", 120, 5, "2024-01-01 15:00:00"),
+        ("A", "sell", 150, 3, "2024-01-03 10:00:00"),
+    ]:
+        db_session.execute(
+            text("INSERT INTO transactions (user_id, name, symbol, type, price, shares, date) "
+                 "VALUES (1, :symbol, :symbol, :type, :price, :shares, :date)"),
+            {"symbol": symbol, "type": kind, "price": price, "shares": shares, "date": stamp})
+    db_session.execute(text("UPDATE users SET cash = 10000 - 1600 + 450 WHERE id = 1"))
+    db_session.commit()
+
+    ledger = LedgerEngine(history, maxsize=10, ttl=3600)
+    series = ledger.value_series(db_session, 1, 10, day_number(date(2024, 1, 4)))
+
+    assert series["dates"] == ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04"]
+    assert series["cash"] == [8400, 8400, 8850, 8850]
+    # Without stored closes, shares are valued at the last traded price
+    assert series["stock_value"] == [15 * 120, 15 * 120, 12 * 150, 12 * 150]
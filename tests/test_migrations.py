@@ -0,0 +1,113 @@
+"""Schema migrations of an existing database and the session table they add."""
+
+import pytest
+from flask import Flask, session
+from sqlalchemy import create_engine, exc, text
+
+from migrations import MIGRATIONS, create_tables, migrate, schema_version
+from sessions import SQLiteSessionInterface
+
+
+@pytest.fixture
+def baseline(tmp_path):
+    """Engine of database created by the app before migrations existed."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'finance.db'}")
+
+    with engine.begin() as connection:
+        # Tables were created with the schema of version 1, user_version stayed 0
+        create_tables(connection)
+        connection.execute(
+            text("INSERT INTO users (id, username, hash) VALUES (1, 'old', 'hash')"))
+        for symbol, kind, price, shares in [("A", "buy", 100, 10), ("A", "buy", 200, 5),
+                                            ("A", "sell", 150, 3), ("B", "buy", 50, 1)]:
+            connection.execute(
+                text("INSERT INTO transactions (user_id, name, symbol, type, price, shares, date) "
+                     "VALUES (1, :symbol, :symbol, :type, :price, :shares, '2024-01-01 10:00:00')"),
+                {"symbol": symbol, "type": kind, "price": price, "shares": shares})
+
+        # Concurrent buys could insert a second wallet row for the same symbol
+        for symbol, shares in [("A", 5), ("B", 1), ("A", 7)]:
+            connection.execute(
+                text("INSERT INTO wallet (user_id, name, symbol, shares) VALUES (1, :symbol, :symbol, :shares)"),
+                {"symbol": symbol, "shares": shares})
+
+    yield engine
+    engine.dispose()
+
+
+def test_baseline_database_is_migrated_to_latest_version(baseline):
+    migrate(baseline)
+
+    with baseline.connect() as connection:
+        assert schema_version(connection) == MIGRATIONS[-1][0]
+
+        wallet = connection.execute(
+            text("SELECT symbol, shares, bought_cost, bought_shares FROM wallet ORDER BY symbol")).all()
+        assert [tuple(row) for row in wallet] == [("A", 12, 2000, 15), ("B", 1, 50, 1)]
+
+        with pytest.raises(exc.IntegrityError):
+            connection.execute(
+                text("INSERT INTO wallet (user_id, name, symbol, shares) VALUES (1, 'A', 'A', 1)"))
+
+
+def test_migrations_resume_from_stored_version(baseline):
+    migrate(baseline, target=2)
+    with baseline.connect() as connection:
+        assert schema_version(connection) == 2
+
+    migrate(baseline)
+    # Nothing left to do, so nothing is run again
+    migrate(baseline)
+
+    with baseline.connect() as connection:
+        assert schema_version(connection) == MIGRATIONS[-1][0]
+        assert connection.execute(text("SELECT COUNT(*) FROM wallet")).scalar() == 2
+
+
+@pytest.fixture
+def session_app(baseline):
+    """App keeping sessions in the table added by migrations to the baseline database."""
+    migrate(baseline)
+
+    app = Flask(__name__)
+    app.session_interface = SQLiteSessionInterface(baseline, lifetime=3600)
+
+    @app.route("/login/<name>")
+    def login(name):
+        session.clear()
+        session["user"] = name
+        return ""
+
+    @app.route("/whoami")
+    def whoami():
+        return session.get("user", "")
+
+    @app.route("/logout")
+    def logout():
+        session.clear()
+        return ""
+
+    return app
+
+
+def stored_sessions(engine):
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT COUNT(*) FROM sessions")).scalar()
+
+
+def test_sessions_survive_requests_and_rotate_on_login(session_app, baseline):
+    client = session_app.test_client()
+
+    client.get("/login/first")
+    first = client.get_cookie("session").value
+    assert client.get("/whoami").text == "first"
+
+    # Logging in again gives a new id and removes the old one
+    client.get("/login/second")
+    assert client.get_cookie("session").value != first
+    assert client.get("/whoami").text == "second"
+    assert stored_sessions(baseline) == 1
+
+    client.get("/logout")
+    assert client.get("/whoami").text == ""
+    assert stored_sessions(baseline) == 0
@@ -0,0 +1,162 @@
+"""Orders executed in single transactions: buy, sell and all-or-nothing baskets."""
+
+import pytest
+from sqlalchemy import text
+
+from orders import LegError, OrderError, execute_basket, execute_buy, execute_sell
+
+
+def stock(symbol, price):
+    return {"name": f"{symbol} Inc", "symbol": symbol, "price": price, "stale": False}
+
+
+@pytest.fixture
+def account(app_module, client):
+    """Database session inside app context and id of the logged in user."""
+    with client.session_transaction() as session:
+        user_id = session["user_id"]
+
+    with app_module.app.app_context():
+        yield app_module.db.session, user_id
+
+
+def state(db_session, user_id):
+    """Cash, wallet and number of transactions of user."""
+    cash = db_session.execute(text("SELECT cash FROM users WHERE id = :id"),
+                              {"id": user_id}).scalar()
+    wallet = db_session.execute(
+        text("SELECT symbol, shares, bought_cost, bought_shares FROM wallet WHERE user_id = :id ORDER BY symbol"),
+        {"id": user_id}).all()
+    transactions = db_session.execute(
+        text("SELECT COUNT(*) FROM transactions WHERE user_id = :id"),
+        {"id": user_id}).scalar()
+    return cash, [tuple(row) for row in wallet], transactions
+
+
+def test_buys_add_up_in_one_wallet_row(account):
+    db_session, user_id = account
+    execute_buy(db_session, user_id, stock("A", 100), 10)
+    execute_buy(db_session, user_id, stock("A", 200), 5)
+
+    assert state(db_session, user_id) == (10000 - 2000, [("A", 15, 2000, 15)], 2)
+
+
+def test_buy_without_enough_cash_changes_nothing(account):
+    db_session, user_id = account
+
+    with pytest.raises(OrderError) as error:
+        execute_buy(db_session, user_id, stock("A", 100), 101)
+
+    assert error.value.code == 403
+    assert state(db_session, user_id) == (10000, [], 0)
+
+
+def test_selling_all_shares_removes_wallet_row(account):
+    db_session, user_id = account
+    execute_buy(db_session, user_id, stock("A", 100), 10)
+    execute_sell(db_session, user_id, "A", 120, 4)
+
+    assert state(db_session, user_id) == (10000 - 1000 + 480, [("A", 6, 1000, 10)], 2)
+
+    execute_sell(db_session, user_id, "A", 120, 6)
+
+    assert state(db_session, user_id) == (10000 - 1000 + 1200, [], 3)
+
+
+def test_selling_more_than_owned_changes_nothing(account):
+    db_session, user_id = account
+    execute_buy(db_session, user_id, stock("A", 100), 10)
+    before = state(db_session, user_id)
+
+    with pytest.raises(OrderError):
+        execute_sell(db_session, user_id, "A", 100, 11)
+    with pytest.raises(OrderError):
+        execute_sell(db_session, user_id, "B", 100, 1)
+
+    assert state(db_session, user_id) == before
+
+
+def test_basket_sells_first_to_pay_for_buys(account):
+    db_session, user_id = account
+    execute_buy(db_session, user_id, stock("A", 100), 100)
+
+    execute_basket(db_session, user_id, [
+        {"type": "buy", "stock": stock("B", 50), "shares": 150},
+        {"type": "sell", "stock": stock("A", 100), "shares": 100},
+    ])
+
+    assert state(db_session, user_id) == (2500, [("B", 150, 7500, 150)], 3)
+
+
+def test_basket_without_enough_cash_changes_nothing(account):
+    db_session, user_id = account
+    execute_buy(db_session, user_id, stock("A", 100), 10)
+    before = state(db_session, user_id)
+
+    with pytest.raises(OrderError) as error:
+        execute_basket(db_session, user_id, [
+            {"type": "sell", "stock": stock("A", 100), "shares": 10},
+            {"type": "buy", "stock": stock("B", 100), "shares": 101},
+        ])
+
+    assert not isinstance(error.value, LegError)
+    assert state(db_session, user_id) == before
+
+
+def test_basket_is_rolled_back_when_one_leg_fails(account):
+    db_session, user_id = account
+    execute_buy(db_session, user_id, stock("A", 100), 10)
+    before = state(db_session, user_id)
+
+    with pytest.raises(LegError) as error:
+        execute_basket(db_session, user_id, [
+            {"type": "buy", "stock": stock("B", 10), "shares": 1},
+            {"type": "sell", "stock": stock("A", 100), "shares": 5},
+            {"type": "sell", "stock": stock("C", 100), "shares": 1},
+        ])
+
+    assert error.value.leg == 2
+    assert state(db_session, user_id) == before
+
+
+@pytest.fixture
+def quotes(app_module, monkeypatch):
+    """Quotes returned to basket route by symbol; missing symbols have none."""
+    from symbols import SymbolIndex
+
+    quotes = {}
+    monkeypatch.setattr(app_module, "lookup_many",
+                        lambda symbols: {symbol: quotes.get(symbol) for symbol in symbols})
+    monkeypatch.setattr(app_module, "symbol_index", lambda *args, **kwargs: SymbolIndex([]))
+    return quotes
+
+
+def test_basket_route_reports_failed_leg_and_cancels_others(client, account, quotes):
+    db_session, user_id = account
+    quotes.update(A=stock("A", 100), B=stock("B", 100))
+
+    response = client.post("/api/v1/orders", json={"orders": [
+        {"symbol": "A", "type": "buy", "shares": 1},
+        {"symbol": "B", "type": "sell", "shares": 1},
+    ]})
+
+    assert response.status_code == 400
+    assert [order["status"] for order in response.json["orders"]] == ["cancelled", "rejected"]
+    assert state(db_session, user_id) == (10000, [], 0)
+
+
+@pytest.mark.parametrize("missing", [None, "stale"])
+def test_basket_route_without_quote_executes_nothing(client, account, quotes, missing):
+    db_session, user_id = account
+    quotes.update(A=stock("A", 100))
+    if missing == "stale":
+        quotes["B"] = dict(stock("B", 100), stale=True)
+
+    response = client.post("/api/v1/orders", json={"orders": [
+        {"symbol": "A", "type": "buy", "shares": 1},
+        {"symbol": "B", "type": "buy", "shares": 1},
+    ]})
+
+    assert response.status_code == 503
+    assert [order["status"] for order in response.json["orders"]] == ["cancelled", "rejected"]
+    assert state(db_session, user_id) == (10000, [], 0)
@@ -0,0 +1,66 @@
+"""Count Finnhub calls made by single requests to routes that look up stocks."""
+
+from collections import Counter
+
+import pytest
+
+
+@pytest.fixture
+def calls(app_module, monkeypatch):
+    """Count Finnhub calls by endpoint, passing them on to the stub."""
+    import finnhub
+    import helpers
+    from symbols import SymbolIndex
+
+    counter = Counter()
+
+    def counting_finnhub_get(path, **params):
+        counter[path] += 1
+        return finnhub.finnhub_get(path, **params)
+
+    monkeypatch.setattr(helpers, "finnhub_get", counting_finnhub_get)
+
+    # Without local symbol list search goes to the API
+    monkeypatch.setattr(helpers, "symbol_index", lambda *args, **kwargs: SymbolIndex([]))
+
+    helpers.invalidate_quote()
+    helpers.last_price_cache.clear()
+    return counter
+
+
+def test_quote_looks_up_profile_and_price_once(client, calls):
+    response = client.post("/quote", data={"symbol": "s1"})
+
+    assert response.status_code == 200
+    assert calls == {"stock/profile2": 1, "quote": 1}
+
+
+def test_buy_looks_up_profile_and_price_once(client, calls):
+    response = client.post("/buy", data={"symbol": "s2", "shares": "1"})
+
+    assert response.status_code == 302
+    assert calls == {"stock/profile2": 1, "quote": 1}
+
+
+def test_search_calls_api_once(client, calls):
+    response = client.post("/search", data={"symbol": "stock 3"})
+
+    assert response.status_code == 200
+    assert calls == {"search": 1}
+
+
+def test_repeated_lookups_in_one_request_are_memoized(app_module, calls):
+    import helpers
+
+    with app_module.app.test_request_context():
+        first = helpers.lookup("s4")
+        assert helpers.lookup("S4") == first
+        assert helpers.search("stock 4") == helpers.search("stock 4")
+
+    assert calls == {"stock/profile2": 1, "quote": 1, "search": 1}
+
+    # Next request looks the symbol up again
+    with app_module.app.test_request_context():
+        helpers.lookup("s4")
+
+    assert calls == {"stock/profile2": 2, "quote": 2, "search": 1}
@@ -0,0 +1,19 @@
+"""Portfolio page valuing wallet rows at current prices."""
+
+from sqlalchemy import text
+
+
+def test_holding_without_recorded_cost_renders(app_module, client):
+    with client.session_transaction() as session:
+        user_id = session["user_id"]
+
+    with app_module.app.app_context():
+        app_module.db.session.execute(
+            text("INSERT INTO wallet (user_id, name, symbol, shares, bought_cost, bought_shares) "
+                 "VALUES (:user_id, 'Stock', 'S1', 5, 0, 0)"), {"user_id": user_id})
+        app_module.db.session.commit()
+
+    response = client.get("/")
+
+    assert response.status_code == 200
+    assert b"S1" in response.data
@@ -0,0 +1,152 @@
+"""Price history files, daily closes and portfolio analytics."""
+
+import os
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pricehistory import SECONDS_PER_DAY, PriceHistory, portfolio_analytics
+
+TODAY = 20000
+
+
+@pytest.fixture
+def history(tmp_path):
+    return PriceHistory(str(tmp_path / "price_history"))
+
+
+def append_daily(history, symbol, prices, first_day):
+    """Append one price at noon of every day starting with first_day."""
+    for offset, price in enumerate(prices):
+        history.append(symbol, price,
+                       (first_day + offset) * SECONDS_PER_DAY + SECONDS_PER_DAY / 2)
+
+
+def test_daily_closes_take_last_record_of_every_day(history):
+    for day in (TODAY - 1, TODAY):
+        for minute in range(3):
+            history.append("A", day * 10 + minute, day * SECONDS_PER_DAY + minute * 60)
+
+    days, closes = history.daily_closes("A")
+
+    assert days.tolist() == [TODAY - 1, TODAY]
+    assert closes.tolist() == [(TODAY - 1) * 10 + 2, TODAY * 10 + 2]
+
+
+def test_daily_closes_of_backfilled_records_take_last_appended(history):
+    history.append("A", 1, TODAY * SECONDS_PER_DAY)
+    history.append("A", 2, (TODAY - 1) * SECONDS_PER_DAY)
+    history.append("A", 3, TODAY * SECONDS_PER_DAY - 1)
+
+    days, closes = history.daily_closes("A")
+
+    assert days.tolist() == [TODAY - 1, TODAY]
+    assert closes.tolist() == [3, 1]
+
+
+def test_daily_closes_of_unknown_symbol_are_empty(history):
+    days, closes = history.daily_closes("NONE")
+
+    assert len(days) == 0 and len(closes) == 0
+
+
+def test_close_matrix_carries_last_close_forward(history):
+    append_daily(history, "A", [10, 11], TODAY - 3)
+    append_daily(history, "B", [20], TODAY)
+
+    grid = np.arange(TODAY - 4, TODAY + 1)
+    closes = history.close_matrix(["A", "B", "NONE"], grid)
+
+    np.testing.assert_array_equal(closes, [
+        [np.nan, 10, 11, 11, 11],
+        [np.nan, np.nan, np.nan, np.nan, 20],
+        [np.nan] * 5,
+    ])
+
+
+def test_compact_keeps_daily_closes_and_today(history):
+    for day in range(TODAY - 3, TODAY + 1):
+        for minute in range(10):
+            history.append("A", day + minute, day * SECONDS_PER_DAY + minute * 60)
+    history.append("B", 1, TODAY * SECONDS_PER_DAY)
+    before = history.daily_closes("A")
+
+    assert history.compact(TODAY) == 27
+    assert len(history.series("A")) == 3 + 10
+    assert len(history.series("B")) == 1
+
+    after = history.daily_closes("A")
+    np.testing.assert_array_equal(before[0], after[0])
+    np.testing.assert_array_equal(before[1], after[1])
+
+    # Nothing left to remove
+    assert history.compact(TODAY) == 0
+
+
+def test_compact_loses_no_concurrent_appends(history):
+    past = (TODAY - 1) * SECONDS_PER_DAY
+    done = threading.Event()
+
+    def append_many():
+        for number in range(2000):
+            history.append("A", number, TODAY * SECONDS_PER_DAY + number)
+        done.set()
+
+    history.append("A", 0, past)
+    thread = threading.Thread(target=append_many)
+    thread.start()
+
+    # Keep rewriting the file while it is appended to
+    while not done.is_set():
+        history.append("A", 0, past)
+        history.compact(TODAY)
+    thread.join()
+    history.compact(TODAY)
+
+    assert len(history.series("A")) == 1 + 2000
+
+
+def test_flat_prices_have_no_returns_or_volatility(history):
+    append_daily(history, "A", [100] * 10, TODAY - 9)
+    # Second position's history starts inside the window
+    append_daily(history, "B", [50] * 3, TODAY - 2)
+
+    analytics = portfolio_analytics(history, [
+        {"symbol": "A", "shares": 1, "invested": 100},
+        {"symbol": "B", "shares": 10, "invested": 500},
+    ], 10, TODAY)
+
+    assert analytics["returns"] == [0.0] * 9
+    assert analytics["volatility"] == 0
+    assert analytics["max_drawdown"] == 0
+    assert analytics["value"] == [100.0] * 7 + [600.0] * 3
+
+
+def test_returns_follow_prices_of_positions_priced_on_both_days(history):
+    append_daily(history, "A", [100, 110, 99], TODAY - 2)
+    append_daily(history, "B", [20], TODAY)
+
+    analytics = portfolio_analytics(history, [
+        {"symbol": "A", "shares": 2, "invested": 200},
+        {"symbol": "B", "shares": 5, "invested": 100},
+    ], 3, TODAY)
+
+    assert analytics["returns"] == pytest.approx([0.1, -0.1])
+    assert analytics["max_drawdown"] == pytest.approx(-0.1)
+    assert analytics["positions"][0]["profit"] == pytest.approx(-2)
+    assert analytics["positions"][1]["last_close"] == 20
+
+
+def test_position_without_history_has_no_profit(history):
+    analytics = portfolio_analytics(history, [
+        {"symbol": "NONE", "shares": 1, "invested": 10},
+    ], 5, TODAY)
+
+    assert analytics["returns"] == [None] * 4
+    assert analytics["volatility"] is None
+    assert analytics["positions"][0]["profit"] is None
+    assert np.all(np.array(analytics["value"]) == 0)
@@ -0,0 +1,128 @@
+"""Local symbol index: ranked search, loading and download of the symbol list."""
+
+import threading
+import time
+
+import pytest
+
+ROWS = [
+    ["AAPL", "AAPL", "APPLE INC", "Common Stock"],
+    ["AA", "AA", "ALCOA CORP", "Common Stock"],
+    ["AAP", "AAP", "ADVANCE AUTO PARTS INC", "Common Stock"],
+    ["MSFT", "MSFT", "MICROSOFT CORP", "Common Stock"],
+    ["APLE", "APLE", "APPLE HOSPITALITY REIT INC", "Common Stock"],
+    ["GOOG", "GOOG", "ALPHABET INC-CL C", "Common Stock"],
+]
+
+
+@pytest.fixture
+def symbols(app_module):
+    """Symbols module, imported once the app is configured against the stub."""
+    import symbols
+
+    return symbols
+
+
+@pytest.fixture
+def index(symbols):
+    return symbols.SymbolIndex(ROWS)
+
+
+def found(entries):
+    return [entry["symbol"] for entry in entries]
+
+
+def test_exact_ticker_goes_first_then_shorter_prefix_matches(index):
+    assert found(index.search("aap")) == ["AAP", "AAPL"]
+    assert found(index.search("AA")) == ["AA", "AAP", "AAPL"]
+
+
+def test_tickers_rank_above_description_matches(index):
+    assert found(index.search("apple")) == ["AAPL", "APLE"]
+    assert found(index.search("ap")) == ["APLE", "AAPL"]
+
+
+def test_every_word_of_query_has_to_match_a_description_word(index):
+    assert found(index.search("apple hosp")) == ["APLE"]
+    assert found(index.search("apple corp")) == []
+
+
+def test_search_respects_limit_and_ignores_blank_query(index):
+    assert len(index.search("a", limit=2)) == 2
+    assert index.search("   ") == []
+
+
+def test_prefix_and_token_lookups(index):
+    assert index.with_prefix("AA") == ["AA", "AAP", "AAPL"]
+    assert index.with_prefix("AA", limit=1) == ["AA"]
+    assert index.with_token_prefix("CORP") == {"AA", "MSFT"}
+    assert "MSFT" in index and "IBM" not in index
+    assert index.get("MSFT")["description"] == "MICROSOFT CORP"
+
+
+@pytest.fixture
+def symbols_path(symbols, tmp_path, monkeypatch):
+    """Point symbols module at an empty directory with fresh module state."""
+    path = tmp_path / "us_symbols.json.gz"
+    monkeypatch.setattr(symbols, "SYMBOLS_PATH", str(path))
+    monkeypatch.setattr(symbols, "_index", symbols.SymbolIndex([]))
+    monkeypatch.setattr(symbols, "_next_check", 0)
+    monkeypatch.setattr(symbols, "_next_download", 0)
+    monkeypatch.setattr(symbols, "_loading", False)
+    return path
+
+
+def test_index_is_reloaded_when_file_changes(symbols, symbols_path, monkeypatch):
+    symbols.save_symbols(ROWS[:1], str(symbols_path))
+    assert found(symbols.symbol_index().search("AAPL")) == ["AAPL"]
+
+    symbols.save_symbols(ROWS, str(symbols_path))
+    assert len(symbols.symbol_index()) == 1
+
+    # Modification time is checked again after SYMBOLS_CHECK_INTERVAL
+    monkeypatch.setattr(symbols, "_next_check", 0)
+    assert len(symbols.symbol_index()) == len(ROWS)
+
+
+def test_missing_file_is_downloaded_once_in_background(symbols, symbols_path, monkeypatch):
+    downloads = []
+
+    def download_symbols():
+        downloads.append(1)
+        return ROWS
+
+    monkeypatch.setattr(symbols, "download_symbols", download_symbols)
+
+    assert len(symbols.symbol_index()) == 0
+    for thread in threading.enumerate():
+        if thread.name == "symbol-download":
+            thread.join()
+
+    # Next checks neither download again nor wait for it
+    monkeypatch.setattr(symbols, "_next_check", 0)
+    assert len(symbols.symbol_index()) == len(ROWS)
+    assert symbols.refresh_symbols() > time.time()
+    assert len(downloads) == 1
+
+
+def test_concurrent_requests_start_one_loader(symbols, symbols_path, monkeypatch):
+    loads = []
+    release = threading.Event()
+
+    def reload_symbols():
+        loads.append(1)
+        release.wait()
+
+    monkeypatch.setattr(symbols, "reload_symbols", reload_symbols)
+
+    requests = [
+        threading.Thread(target=symbols.symbol_index, kwargs={"wait": False})
+        for _ in range(20)
+    ]
+    for thread in requests:
+        thread.start()
+    for thread in requests:
+        thread.join()
+
+    release.set()
+    assert len(loads) == 1